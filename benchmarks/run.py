@@ -0,0 +1,293 @@
+# benchmarks/run.py
+"""
+Benchmarks for the generation pipeline: ``python -m benchmarks.run``.
+
+Each case records wall time (best of --repeat runs), lines per second where
+it produces G-code, and peak traced memory (from one extra run under
+tracemalloc). Results can be saved as a baseline and later runs compared
+against it:
+
+    python -m benchmarks.run --save-baseline benchmarks/baseline.json
+    python -m benchmarks.run --baseline benchmarks/baseline.json --threshold 0.25
+
+A case regresses when its time grows by more than --threshold or its peak
+memory by more than --memory-threshold (fractions of the baseline). The
+command exits 1 if any case regresses. Baselines are machine-specific and
+are not committed.
+
+``--imports`` checks cold import times instead: each module in
+IMPORT_BUDGETS_MS is imported in a fresh interpreter (best of --repeat, from
+warm bytecode) and must stay within its budget without pulling in any of
+HEAVY_MODULES. The command exits 1 on a breach.
+"""
+
+import argparse
+import io
+import json
+import os
+import subprocess
+import sys
+import tempfile
+import time
+import tracemalloc
+
+QUANTITIES = (1, 10, 100, 1000, 10000)
+QUICK_QUANTITIES = (1, 10, 100, 1000)
+SHAPES = ("circle", "oval", "caplet")
+HEAD_MODES = ("Single Head", "Dual Head")
+TEMPLATE_MOVES = 200000
+
+# Cumulative import time allowed per module, in milliseconds
+IMPORT_BUDGETS_MS = {
+    "gcode.generator": 20,
+    "gcode.batch": 20,
+    "gcode.cli": 40,
+    "utils.pdf_export": 20,
+    "utils.logs": 40,
+    "utils.registry": 20
+}
+# Loaded on first use only (PDF rendering, DataFrames, the UI)
+HEAVY_MODULES = ("pandas", "numpy", "fpdf", "streamlit")
+
+
+def _gcode_cases(quantities: tuple) -> list:
+    from gcode.generator import generate_gcode
+
+    cases = []
+    for shape in SHAPES:
+        for head_mode in HEAD_MODES:
+            for quantity in quantities:
+                name = f"gcode/{shape}/{head_mode.split()[0].lower()}/{quantity}"
+                call = lambda q=quantity, s=shape, h=head_mode: generate_gcode(q, 300.0, shape=s, head_mode=h)
+                cases.append((name, call, True))
+    return cases
+
+
+def _shape_cases() -> list:
+    from gcode.shapes import clear_shape_cache, get_shape_path
+
+    def uncached(shape):
+        clear_shape_cache()
+        return get_shape_path(shape)
+
+    return [(f"shape/{shape}", lambda s=shape: uncached(s), False) for shape in SHAPES]
+
+
+def _synthetic_template(moves: int) -> bytes:
+    lines = []
+    for i in range(moves):
+        if i % 100 == 0:
+            lines.append(f";LAYER:{i // 100}")
+            lines.append(f"G0 Z{0.4 * (i // 100 + 1):.2f} F600")
+        lines.append(f"G1 X{i % 97 * 0.31:.3f} Y{i % 89 * 0.27:.3f} E{i * 0.00123:.5f}")
+    return "\n".join(lines).encode("utf-8")
+
+
+def _template_cases(moves: int) -> list:
+    from gcode.template import clear_template_cache, iter_line_batches, iter_rewritten, load_template, render_template
+
+    data = _synthetic_template(moves)
+    parsed = load_template(io.BytesIO(data))
+
+    def parse():
+        clear_template_cache()
+        return load_template(io.BytesIO(data))
+
+    return [
+        (f"template/stream/{moves}", lambda: "".join(iter_rewritten(iter_line_batches(io.BytesIO(data)), 0.0123, moves // 2)), True),
+        (f"template/parse/{moves}", parse, False),
+        (f"template/reinject/{moves}", lambda: render_template(parsed, 0.0123, moves // 2), True)
+    ]
+
+
+def _pdf_cases() -> list:
+    import pandas as pd
+    from utils.pdf_export import clear_pdf_cache, generate_pdf
+
+    df = pd.DataFrame([
+        {"name": f"API {i + 1}", "ingredient_type": "API", "percentage": 5.0 * (i + 1), "total_mg": 150.0 * (i + 1)}
+        for i in range(4)
+    ])
+
+    def uncached():
+        clear_pdf_cache()
+        return generate_pdf(df, product_name="Benchmark", quantity=30, unit_weight=400.0)
+
+    return [("pdf/4-apis", uncached, False)]
+
+
+def _formulation_cases(orders: int = 10000) -> list:
+    from utils.formulation import formulate_orders
+    from utils.registry import get_section
+
+    api_limits = get_section("products")["api_limits"]
+    base_templates = get_section("products")["base_templates"]
+    product_types = list(base_templates)
+    batch = [
+        {
+            "product_type": product_types[i % len(product_types)],
+            "apis": [{"name": f"API {j + 1}", "strength": 0.5 + (i * 7 + j) % 40} for j in range(i % 4 + 1)],
+            "quantity": i % 100 + 1
+        }
+        for i in range(orders)
+    ]
+    return [(f"formulation/{orders}-orders", lambda: formulate_orders(batch, api_limits, base_templates), False)]
+
+
+def _log_cases(rows: int = 100) -> list:
+    from utils.logs import flush_logs, log_session
+
+    def write_rows():
+        with tempfile.TemporaryDirectory() as tmp:
+            path = os.path.join(tmp, "logs.csv")
+            for i in range(rows):
+                log_session(path, {
+                    "shape": "oval", "quantity": i + 1, "head_mode": "Single Head",
+                    "api_total_mg": 5.0, "unit_weight_mg": 20.0
+                })
+            flush_logs()
+
+    return [(f"log/{rows}-rows", write_rows, False)]
+
+
+def run_case(call, counts_lines: bool, repeat: int) -> dict:
+    """Best wall time of `repeat` runs, lines/s and peak traced memory."""
+    best = None
+    result = None
+    for _ in range(repeat):
+        start = time.perf_counter()
+        result = call()
+        elapsed = time.perf_counter() - start
+        best = elapsed if best is None else min(best, elapsed)
+
+    lines = result.count("\n") + 1 if counts_lines else None
+    del result
+    tracemalloc.start()
+    call()
+    _, peak = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+
+    return {
+        "wall_s": best,
+        "lines_per_s": lines / best if lines and best else None,
+        "peak_mb": peak / 1e6
+    }
+
+
+def collect_cases(quick: bool = False, only: str = None) -> list:
+    cases = _gcode_cases(QUICK_QUANTITIES if quick else QUANTITIES)
+    cases += _shape_cases()
+    cases += _template_cases(TEMPLATE_MOVES // 10 if quick else TEMPLATE_MOVES)
+    cases += _pdf_cases()
+    cases += _formulation_cases()
+    cases += _log_cases()
+    if only:
+        cases = [case for case in cases if case[0].startswith(only)]
+    return cases
+
+
+def _import_probe(module: str) -> tuple:
+    """(cumulative import ms, heavy modules loaded) for `module` in a fresh interpreter."""
+    root = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+    env = dict(os.environ)
+    # Measure against cached bytecode, as a deployed app would
+    env.pop("PYTHONDONTWRITEBYTECODE", None)
+    probe = f"import sys, {module}; print(' '.join(m for m in {HEAVY_MODULES!r} if m in sys.modules))"
+    proc = subprocess.run(
+        [sys.executable, "-X", "importtime", "-c", probe],
+        cwd=root, env=env, capture_output=True, text=True, check=True
+    )
+    cumulative_us = 0
+    for line in proc.stderr.splitlines():
+        # "import time: self [us] | cumulative | imported package"
+        fields = line.split("|")
+        if len(fields) == 3 and fields[2].strip() == module:
+            cumulative_us = int(fields[1])
+    return cumulative_us / 1000, proc.stdout.split()
+
+
+def check_imports(repeat: int) -> list:
+    """Return a list of budget breaches for IMPORT_BUDGETS_MS."""
+    breaches = []
+    print(f"{'module':<34} {'import ms':>10} {'budget':>8}")
+    for module, budget in IMPORT_BUDGETS_MS.items():
+        _import_probe(module)  # writes bytecode for the timed runs
+        runs = [_import_probe(module) for _ in range(repeat)]
+        best = min(ms for ms, _ in runs)
+        heavy = runs[0][1]
+        print(f"{module:<34} {best:>10.1f} {budget:>8}")
+        if best > budget:
+            breaches.append(f"{module}: {best:.1f} ms import vs {budget} ms budget")
+        if heavy:
+            breaches.append(f"{module}: imports {', '.join(heavy)} at module level")
+    return breaches
+
+
+def compare(results: dict, baseline: dict, threshold: float, memory_threshold: float) -> list:
+    """Return a list of regression messages for cases present in both runs."""
+    regressions = []
+    for name, result in results.items():
+        base = baseline.get(name)
+        if not base:
+            continue
+        if base["wall_s"] and result["wall_s"] > base["wall_s"] * (1 + threshold):
+            regressions.append(
+                f"{name}: {result['wall_s'] * 1000:.1f} ms vs {base['wall_s'] * 1000:.1f} ms baseline"
+            )
+        if base["peak_mb"] and result["peak_mb"] > base["peak_mb"] * (1 + memory_threshold):
+            regressions.append(
+                f"{name}: peak {result['peak_mb']:.1f} MB vs {base['peak_mb']:.1f} MB baseline"
+            )
+    return regressions
+
+
+def main(argv: list = None) -> int:
+    parser = argparse.ArgumentParser(prog="python -m benchmarks.run", description="Benchmark the generation pipeline.")
+    parser.add_argument("--quick", action="store_true", help="smaller sweep (up to 1,000 units)")
+    parser.add_argument("--only", default=None, help="run cases whose name starts with this prefix")
+    parser.add_argument("--repeat", type=int, default=3, help="timed runs per case (best is kept)")
+    parser.add_argument("--baseline", default=None, help="baseline JSON to compare against")
+    parser.add_argument("--save-baseline", default=None, help="write results as a baseline JSON")
+    parser.add_argument("--threshold", type=float, default=0.25, help="allowed time growth (default 0.25 = 25%%)")
+    parser.add_argument("--memory-threshold", type=float, default=0.25, help="allowed peak memory growth")
+    parser.add_argument("--imports", action="store_true", help="check import times against IMPORT_BUDGETS_MS")
+    args = parser.parse_args(argv)
+
+    if args.imports:
+        breaches = check_imports(max(1, args.repeat))
+        if breaches:
+            print(f"{len(breaches)} import budget breach(es):", file=sys.stderr)
+            for message in breaches:
+                print(f"  {message}", file=sys.stderr)
+            return 1
+        print("All imports within budget.")
+        return 0
+
+    results = {}
+    print(f"{'case':<34} {'wall ms':>10} {'lines/s':>12} {'peak MB':>9}")
+    for name, call, counts_lines in collect_cases(args.quick, args.only):
+        result = run_case(call, counts_lines, max(1, args.repeat))
+        results[name] = result
+        rate = f"{result['lines_per_s']:,.0f}" if result["lines_per_s"] else "-"
+        print(f"{name:<34} {result['wall_s'] * 1000:>10.1f} {rate:>12} {result['peak_mb']:>9.1f}")
+
+    if args.save_baseline:
+        with open(args.save_baseline, "w") as f:
+            json.dump(results, f, indent=2, sort_keys=True)
+        print(f"Baseline written to {args.save_baseline}")
+
+    if args.baseline:
+        with open(args.baseline) as f:
+            baseline = json.load(f)
+        regressions = compare(results, baseline, args.threshold, args.memory_threshold)
+        if regressions:
+            print(f"{len(regressions)} regression(s):", file=sys.stderr)
+            for message in regressions:
+                print(f"  {message}", file=sys.stderr)
+            return 1
+        print("No regressions against baseline.")
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,6 @@
+# gcode/__main__.py
+import sys
+
+from gcode.cli import main
+
+sys.exit(main())
@@ -0,0 +1,78 @@
+# gcode/arcs.py
+
+import math
+
+
+def _circle_through(p1: tuple, p2: tuple, p3: tuple):
+    """Return (cx, cy, r) of the circle through three points, or None if collinear."""
+    (x1, y1), (x2, y2), (x3, y3) = p1, p2, p3
+    d = 2 * (x1 * (y2 - y3) + x2 * (y3 - y1) + x3 * (y1 - y2))
+    if abs(d) < 1e-12:
+        return None
+    s1, s2, s3 = x1 * x1 + y1 * y1, x2 * x2 + y2 * y2, x3 * x3 + y3 * y3
+    cx = (s1 * (y2 - y3) + s2 * (y3 - y1) + s3 * (y1 - y2)) / d
+    cy = (s1 * (x3 - x2) + s2 * (x1 - x3) + s3 * (x2 - x1)) / d
+    return cx, cy, math.dist((cx, cy), p1)
+
+
+def _fit(points, i: int, j: int, tolerance: float, max_sweep: float, max_radius: float):
+    """Fit one arc to points[i..j]; return (cx, cy, clockwise) or None."""
+    circle = _circle_through(points[i], points[(i + j) // 2], points[j])
+    if circle is None:
+        return None
+    cx, cy, r = circle
+    if r > max_radius:
+        return None
+
+    sweep = 0.0
+    direction = 0
+    for k in range(i, j):
+        (x0, y0), (x1, y1) = points[k], points[k + 1]
+        if abs(math.dist((cx, cy), points[k + 1]) - r) > tolerance:
+            return None
+        ux, uy, vx, vy = x0 - cx, y0 - cy, x1 - cx, y1 - cy
+        cross = ux * vy - uy * vx
+        turn = 1 if cross > 0 else -1
+        if direction and turn != direction:
+            return None
+        direction = turn
+        sweep += abs(math.atan2(cross, ux * vx + uy * vy))
+    if sweep > max_sweep + 1e-9:
+        return None
+    return cx, cy, direction < 0
+
+
+def fit_arcs(
+    points,
+    tolerance: float = 0.01,
+    max_sweep: float = math.pi,
+    max_radius: float = 1000.0
+) -> list:
+    """
+    Group a polyline into G2/G3 arcs where its vertices lie on a common circle.
+
+    Returns runs of (start, end, arc): points[start..end] become a single
+    move to points[end], with arc = (cx, cy, clockwise) for an arc or None
+    for a straight segment. Every vertex of an arc run lies within
+    `tolerance` mm of the arc, and each arc turns one way through at most
+    `max_sweep` radians.
+    """
+    runs = []
+    n = len(points)
+    i = 0
+    while i < n - 1:
+        best = None
+        j = i + 2
+        while j < n:
+            arc = _fit(points, i, j, tolerance, max_sweep, max_radius)
+            if arc is None:
+                break
+            best = (j, arc)
+            j += 1
+        if best:
+            runs.append((i, best[0], best[1]))
+            i = best[0]
+        else:
+            runs.append((i, i + 1, None))
+            i += 1
+    return runs
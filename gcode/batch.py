@@ -0,0 +1,242 @@
+# gcode/batch.py
+
+import math
+import os
+
+from gcode.generator import (
+    FOOTER, generate_gcode, get_travel_feedrate, iter_gcode, iter_unit_blocks, program_header, write_gcode
+)
+from gcode.tray import get_columns, get_traversal_order
+
+# Order spec keys passed straight through to the generator
+GCODE_FIELDS = (
+    "quantity", "unit_volume_mm3", "shape", "layer_height",
+    "tablet_height", "line_width", "head_mode", "spacing", "traversal", "order", "schedule", "infill", "arc_tolerance", "layout",
+    "travel_feedrate"
+)
+
+
+def _order_name(index: int, order: dict) -> str:
+    """
+    The file name stem for an order: its "name" with path separators
+    replaced, or order_<n> by position if it has no usable name.
+    """
+    name = str(order.get("name") or "").strip().replace("/", "_").replace("\\", "_")
+    if not name.strip("."):
+        # Empty, "." or ".." would not name a file in the output directory
+        return f"order_{index + 1:03d}"
+    return name
+
+
+def _unique_names(orders: list) -> list:
+    """
+    One file name stem per order. A name already taken in the batch (compared
+    case-insensitively, as on macOS and Windows) gets a _2, _3, ... suffix,
+    so no two workers write the same file.
+    """
+    names = []
+    taken = set()
+    for i, order in enumerate(orders):
+        name = base = _order_name(i, order)
+        suffix = 2
+        while name.lower() in taken:
+            name = f"{base}_{suffix}"
+            suffix += 1
+        taken.add(name.lower())
+        names.append(name)
+    return names
+
+
+def _render_pdf(order: dict) -> bytes:
+    """
+    Render the formulation worksheet for an order carrying its `unit_weight`
+    in mg and either worksheet rows in `formula` (utils.formulation) or an
+    `apis` list of {"name", "strength"} records, listed without excipients.
+    """
+    from utils.pdf_export import generate_pdf
+
+    quantity = order["quantity"]
+    unit_weight = order["unit_weight"]
+    formula = order.get("formula")
+    if formula is None:
+        formula = [
+            {
+                "name": api["name"],
+                "ingredient_type": "API",
+                "percentage": api["strength"] / unit_weight * 100 if unit_weight else 0,
+                "total_mg": api["strength"] * quantity
+            }
+            for api in order["apis"]
+        ]
+    return generate_pdf(
+        formula,
+        product_name=order.get("product_name", "CraftHealth"),
+        quantity=quantity,
+        unit_weight=unit_weight
+    )
+
+
+def _write_atomic(path: str, write, mode: str = "w"):
+    """Write through `write(fileobj)` into a temp file, then move it into place."""
+    partial = path + ".part"
+    try:
+        with open(partial, mode) as f:
+            write(f)
+        os.replace(partial, path)
+    finally:
+        if os.path.exists(partial):
+            os.remove(partial)
+
+
+def run_order(index: int, order: dict, output_dir: str = None, name: str = None) -> dict:
+    """
+    Generate the G-code (and PDF, if the order lists APIs) for one order,
+    written as <name>.gcode / <name>.pdf under `output_dir`. Errors are
+    captured in the result rather than raised.
+    """
+    name = name or _order_name(index, order)
+    result = {"index": index, "name": name, "error": None}
+    try:
+        kwargs = {k: order[k] for k in GCODE_FIELDS if k in order}
+        if output_dir:
+            gcode_path = os.path.join(output_dir, f"{name}.gcode")
+            _write_atomic(gcode_path, lambda f: write_gcode(f, **kwargs))
+            result["gcode_path"] = gcode_path
+        else:
+            result["gcode"] = generate_gcode(**kwargs)
+
+        if order.get("apis"):
+            pdf_bytes = _render_pdf(order)
+            if output_dir:
+                pdf_path = os.path.join(output_dir, f"{name}.pdf")
+                _write_atomic(pdf_path, lambda f: f.write(pdf_bytes), "wb")
+                result["pdf_path"] = pdf_path
+            else:
+                result["pdf"] = pdf_bytes
+    except Exception as e:
+        result["error"] = f"{type(e).__name__}: {e}"
+    return result
+
+
+def generate_batch(orders: list, output_dir: str = None, max_workers: int = None) -> list:
+    """
+    Generate many orders in parallel worker processes. Results come back in
+    the same order as `orders`; a failed order carries its message in
+    result["error"] and does not stop the others. Orders sharing a name are
+    written under suffixed names (see result["name"]).
+    """
+    names = _unique_names(orders)
+    if output_dir:
+        os.makedirs(output_dir, exist_ok=True)
+    if max_workers is None:
+        max_workers = os.cpu_count() or 1
+    max_workers = max(1, min(max_workers, len(orders) or 1))
+
+    if max_workers == 1:
+        return [run_order(i, order, output_dir, names[i]) for i, order in enumerate(orders)]
+
+    # Imported here: it costs more than the rest of the module to load
+    from concurrent.futures import ProcessPoolExecutor
+
+    results = []
+    with ProcessPoolExecutor(max_workers=max_workers) as pool:
+        futures = [pool.submit(run_order, i, order, output_dir, names[i]) for i, order in enumerate(orders)]
+        for i, future in enumerate(futures):
+            try:
+                results.append(future.result())
+            except Exception as e:
+                # Worker died or the order could not be sent to it
+                results.append({
+                    "index": i,
+                    "name": names[i],
+                    "error": f"{type(e).__name__}: {e}"
+                })
+    return results
+
+
+def _render_units(quantity: int, unit_volume_mm3: float, kwargs: dict, positions: list) -> str:
+    """Render the tray units at `positions` (in print order); runs in a worker process."""
+    return "".join(iter_unit_blocks(quantity, unit_volume_mm3, positions=positions, **kwargs))
+
+
+def split_traversal(quantity: int, kwargs: dict, chunk_size: int) -> tuple:
+    """
+    Compute the traversal of a tray once and split it into `chunk_size`
+    slices for _render_units. Returns (sequence, slices, worker_kwargs);
+    the worker kwargs leave out the traversal settings the slices replace
+    and fix the travel feedrate, so workers never read the registry.
+    """
+    sequence = get_traversal_order(
+        quantity, get_columns(quantity), kwargs.get("traversal", "row-major"), kwargs.get("order")
+    )
+    slices = [sequence[i:i + chunk_size] for i in range(0, quantity, chunk_size)]
+    worker_kwargs = {k: v for k, v in kwargs.items() if k not in ("traversal", "order")}
+    if worker_kwargs.get("travel_feedrate") is None:
+        worker_kwargs["travel_feedrate"] = get_travel_feedrate()
+    return sequence, slices, worker_kwargs
+
+
+def iter_gcode_parallel(
+    quantity: int,
+    unit_volume_mm3: float,
+    max_workers: int = None,
+    chunk_size: int = None,
+    **kwargs
+):
+    """
+    Yield the same chunks as iter_gcode for one tray, rendering the unit
+    index range in chunks across worker processes. Chunks are yielded in
+    tray order, so the joined output is identical to the serial path.
+    """
+    if kwargs.get("schedule", "unit") != "unit" or kwargs.get("layout") == "subroutine":
+        # Layer-interleaved programs are not split by unit range, and a
+        # subroutine program is small enough to generate serially
+        yield from iter_gcode(quantity, unit_volume_mm3, **kwargs)
+        return
+
+    kwargs.pop("schedule", None)
+    if max_workers is None:
+        max_workers = os.cpu_count() or 1
+    if chunk_size is None:
+        # A few chunks per worker keeps the pool busy without tiny tasks
+        chunk_size = max(1, math.ceil(quantity / (max_workers * 4)))
+    # Validate the order up front so errors surface before any output; the
+    # traversal is computed once here and each worker gets its slice
+    sequence, slices, worker_kwargs = split_traversal(quantity, kwargs, chunk_size)
+    iter_unit_blocks(quantity, unit_volume_mm3, positions=[], **worker_kwargs)
+
+    yield program_header(
+        quantity, kwargs.get("spacing", 24.0), kwargs.get("traversal", "row-major"), kwargs.get("order"), sequence,
+        travel_feedrate=worker_kwargs["travel_feedrate"]
+    )
+
+    if max_workers == 1 or len(slices) <= 1:
+        yield from iter_unit_blocks(quantity, unit_volume_mm3, positions=sequence, **worker_kwargs)
+    else:
+        from concurrent.futures import ProcessPoolExecutor
+
+        with ProcessPoolExecutor(max_workers=min(max_workers, len(slices))) as pool:
+            yield from pool.map(
+                _render_units,
+                [quantity] * len(slices),
+                [unit_volume_mm3] * len(slices),
+                [worker_kwargs] * len(slices),
+                slices
+            )
+
+    yield "\n".join(FOOTER)
+
+
+def generate_gcode_parallel(
+    quantity: int,
+    unit_volume_mm3: float,
+    max_workers: int = None,
+    chunk_size: int = None,
+    **kwargs
+) -> str:
+    """
+    Parallel equivalent of generate_gcode for very large trays.
+    """
+    return "".join(iter_gcode_parallel(
+        quantity, unit_volume_mm3, max_workers=max_workers, chunk_size=chunk_size, **kwargs
+    ))
@@ -0,0 +1,195 @@
+# gcode/cli.py
+"""
+Headless batch generation: ``python -m gcode orders.csv -o output``.
+
+An order file is a JSON list of order objects (or {"orders": [...]}) or a
+CSV file with one order per row. Orders use the batch.GCODE_FIELDS keys
+plus optional "name", "product_name", "product_type", "unit_weight" (mg)
+and "apis". In CSV, "apis" is written as "name:strength;name:strength"
+and a custom traversal "order" as space-separated unit indices.
+
+An order with "apis" needs a "product_type" from the registry's products
+section and is formulated by utils.formulation like the formulation
+builder does: the type's API limit (or the order's "max_api_percent")
+sets the unit weight and volume, its base template the excipients listed
+in the PDF. This module must not import streamlit.
+"""
+
+import argparse
+import csv
+import json
+import os
+import sys
+
+from gcode.batch import _order_name, generate_batch
+
+INT_FIELDS = ("quantity",)
+FLOAT_FIELDS = (
+    "unit_volume_mm3", "layer_height", "tablet_height", "line_width",
+    "spacing", "arc_tolerance", "unit_weight", "max_api_percent"
+)
+
+
+def _parse_apis(text: str) -> list:
+    apis = []
+    for item in text.split(";"):
+        if not item.strip():
+            continue
+        name, sep, strength = item.rpartition(":")
+        if not sep or not name.strip():
+            raise ValueError(f"Bad API entry '{item.strip()}'. Use name:strength.")
+        apis.append({"name": name.strip(), "strength": float(strength)})
+    return apis
+
+
+def _from_csv_row(row: dict) -> dict:
+    """Convert a CSV row's text cells to order values; empty cells are dropped."""
+    order = {}
+    for key, value in row.items():
+        if key is None or value is None or not value.strip():
+            continue
+        key, value = key.strip(), value.strip()
+        if key in INT_FIELDS:
+            order[key] = int(value)
+        elif key in FLOAT_FIELDS:
+            order[key] = float(value)
+        elif key == "apis":
+            order[key] = _parse_apis(value)
+        elif key == "order":
+            order[key] = [int(i) for i in value.replace(",", " ").split()]
+        else:
+            order[key] = value
+    return order
+
+
+def _is_json(path: str) -> bool:
+    return path.lower().endswith(".json")
+
+
+def read_orders(path: str) -> list:
+    """
+    Load raw orders from a .json or .csv file. CSV rows keep their text
+    cells until prepare_order converts them, so a bad cell only fails its
+    own order.
+    """
+    with open(path, newline="") as f:
+        if _is_json(path):
+            data = json.load(f)
+            orders = data["orders"] if isinstance(data, dict) else data
+            if not isinstance(orders, list):
+                raise ValueError("JSON order file must hold a list of orders.")
+            return orders
+        return list(csv.DictReader(f))
+
+
+def prepare_order(raw: dict, csv_row: bool = False) -> dict:
+    """
+    Turn a raw order (JSON object, or CSV row if `csv_row`) into a batch
+    order, filling in unit_weight and unit_volume_mm3 where missing and
+    the worksheet rows ("formula") for orders with APIs.
+    """
+    if not isinstance(raw, dict):
+        raise ValueError("Order must be an object.")
+    order = _from_csv_row(raw) if csv_row else dict(raw)
+
+    if "quantity" not in order:
+        raise ValueError("Order needs a quantity.")
+    if order.get("apis"):
+        # Imported here so only orders that need a formulation load numpy
+        from utils.formulation import formulate_order
+        from utils.registry import get_section
+
+        products = get_section("products")
+        if "product_type" not in order:
+            raise ValueError(f"Order with apis needs a product_type. Use one of: {', '.join(products['base_templates'])}.")
+        api_limits = dict(products["api_limits"])
+        if "max_api_percent" in order:
+            api_limits[order["product_type"]] = order["max_api_percent"]
+        formulation = formulate_order(order, api_limits, products["base_templates"])
+        order["unit_weight"] = formulation["unit_weight_mg"]
+        order["formula"] = formulation["rows"]
+        order.setdefault("unit_volume_mm3", formulation["unit_volume_mm3"])
+        order.setdefault("product_name", f"CraftHealth {order['product_type']}")
+    elif "unit_volume_mm3" not in order:
+        from utils.formulation import DENSITY_MG_PER_ML
+
+        if not order.get("unit_weight"):
+            raise ValueError("Order needs unit_volume_mm3, unit_weight or apis.")
+        order["unit_volume_mm3"] = order["unit_weight"] / DENSITY_MG_PER_ML * 1000
+    return order
+
+
+def _log_row(order: dict) -> dict:
+    return {
+        "shape": order.get("shape", "circle"),
+        "quantity": order["quantity"],
+        "head_mode": order.get("head_mode", "Single Head"),
+        "api_total_mg": sum(api["strength"] for api in order.get("apis", [])),
+        "unit_weight_mg": order.get("unit_weight", 0),
+        "apis": order.get("apis", [])
+    }
+
+
+def main(argv: list = None) -> int:
+    parser = argparse.ArgumentParser(
+        prog="python -m gcode",
+        description="Generate G-code, formulation PDFs and log rows for every order in a CSV or JSON file."
+    )
+    parser.add_argument("orders", help="order file (.csv or .json)")
+    parser.add_argument("-o", "--output-dir", default="output", help="where to write files (default: output)")
+    parser.add_argument("-j", "--jobs", type=int, default=None, help="worker processes (default: CPU count)")
+    parser.add_argument("--log", default=None, help="session log CSV (default: <output-dir>/logs.csv)")
+    parser.add_argument("--no-log", action="store_true", help="do not write log rows")
+    args = parser.parse_args(argv)
+
+    if args.jobs is not None and args.jobs < 1:
+        parser.error("--jobs must be at least 1")
+    try:
+        raw_orders = read_orders(args.orders)
+    except (OSError, ValueError, KeyError) as e:
+        print(f"Cannot read {args.orders}: {e}", file=sys.stderr)
+        return 2
+
+    # Orders that cannot be prepared fail on their own without stopping the batch
+    errors = {}
+    orders = []
+    csv_rows = not _is_json(args.orders)
+    for i, raw in enumerate(raw_orders):
+        try:
+            order = prepare_order(raw, csv_rows)
+            # Name by position in the file, not in the batch of valid orders
+            order["name"] = _order_name(i, order)
+        except (ValueError, TypeError, KeyError) as e:
+            errors[i] = f"{type(e).__name__}: {e}"
+            order = None
+        orders.append(order)
+
+    runnable = [i for i, order in enumerate(orders) if order is not None]
+    batch = generate_batch([orders[i] for i in runnable], args.output_dir, max_workers=args.jobs)
+    results = {}
+    for i, result in zip(runnable, batch):
+        results[i] = result
+        if result["error"]:
+            errors[i] = result["error"]
+
+    if not args.no_log and results:
+        from utils.logs import log_session
+
+        log_path = args.log or os.path.join(args.output_dir, "logs.csv")
+        for i in runnable:
+            if i not in errors:
+                log_session(log_path, _log_row(orders[i]))
+
+    for i in range(len(raw_orders)):
+        if i in errors:
+            raw = raw_orders[i] if isinstance(raw_orders[i], dict) else {}
+            print(f"FAILED {_order_name(i, raw)}: {errors[i]}", file=sys.stderr)
+        else:
+            result = results[i]
+            files = [result[k] for k in ("gcode_path", "pdf_path") if k in result]
+            print(f"ok     {result['name']}: {', '.join(files)}")
+
+    if errors:
+        print(f"{len(errors)} of {len(raw_orders)} orders failed.", file=sys.stderr)
+        return 1
+    return 0
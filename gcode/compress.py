@@ -0,0 +1,219 @@
+# gcode/compress.py
+"""
+Compressed G-code output and a matching streaming reader.
+
+Two formats are supported besides plain text:
+
+* gzip: the plain program compressed with gzip (``.gcode.gz``).
+* binary (``.gcodeb``): ``MAGIC`` followed by a zlib stream of line records.
+  Each record starts with an unsigned LEB128 varint. ``0`` means a literal
+  line follows as ``varint length + UTF-8 bytes`` and is appended to the line
+  table; ``k >= 1`` repeats entry ``k - 1`` of the table. Encoder and decoder
+  both clear the table when it reaches ``LINE_TABLE_SIZE`` entries, so memory
+  stays bounded on either side.
+"""
+
+import gzip
+import zlib
+
+from gcode.generator import iter_gcode
+
+MAGIC = b"NCCG\x01"
+GZIP_MAGIC = b"\x1f\x8b"
+LINE_TABLE_SIZE = 65536
+READ_SIZE = 1 << 16
+
+
+def _iter_lines(chunks):
+    """
+    Split text chunks into lines (like str.splitlines) without joining the
+    whole program first.
+    """
+    pending = ""
+    for chunk in chunks:
+        lines = (pending + chunk).split("\n")
+        pending = lines.pop()
+        yield from lines
+    if pending:
+        yield pending
+
+
+def _varint(n: int) -> bytes:
+    out = bytearray()
+    while True:
+        byte = n & 0x7F
+        n >>= 7
+        if n:
+            out.append(byte | 0x80)
+        else:
+            out.append(byte)
+            return bytes(out)
+
+
+def iter_gzip(chunks, level: int = 6):
+    """Yield gzip-compressed bytes for an iterable of text chunks."""
+    # wbits=31 writes a gzip container with mtime 0, so output is reproducible
+    compressor = zlib.compressobj(level, zlib.DEFLATED, 31)
+    for chunk in chunks:
+        data = compressor.compress(chunk.encode("utf-8"))
+        if data:
+            yield data
+    yield compressor.flush()
+
+
+def iter_binary(chunks, level: int = 6):
+    """Yield the compact binary encoding for an iterable of text chunks."""
+    yield MAGIC
+    compressor = zlib.compressobj(level)
+    table = {}
+    for line in _iter_lines(chunks):
+        index = table.get(line)
+        if index is not None:
+            record = _varint(index + 1)
+        else:
+            if len(table) >= LINE_TABLE_SIZE:
+                table.clear()
+            table[line] = len(table)
+            raw = line.encode("utf-8")
+            record = b"\x00" + _varint(len(raw)) + raw
+        data = compressor.compress(record)
+        if data:
+            yield data
+    yield compressor.flush()
+
+
+def iter_gcode_gzip(quantity: int, unit_volume_mm3: float, **kwargs):
+    """Yield a gzip-compressed G-code program as bytes chunks."""
+    return iter_gzip(iter_gcode(quantity, unit_volume_mm3, **kwargs))
+
+
+def iter_gcode_binary(quantity: int, unit_volume_mm3: float, **kwargs):
+    """Yield a binary-encoded G-code program as bytes chunks."""
+    return iter_binary(iter_gcode(quantity, unit_volume_mm3, **kwargs))
+
+
+def generate_gcode_gzip(quantity: int, unit_volume_mm3: float, **kwargs) -> bytes:
+    """
+    Generate a gzip-compressed G-code program, e.g. for st.download_button.
+    """
+    return b"".join(iter_gcode_gzip(quantity, unit_volume_mm3, **kwargs))
+
+
+def write_gcode_compressed(fileobj, quantity: int, unit_volume_mm3: float, fmt: str = "gzip", **kwargs) -> int:
+    """
+    Stream a compressed G-code program into a binary file object.
+    `fmt` is "gzip" or "binary". Returns the number of bytes written.
+    """
+    if fmt == "gzip":
+        chunks = iter_gcode_gzip(quantity, unit_volume_mm3, **kwargs)
+    elif fmt == "binary":
+        chunks = iter_gcode_binary(quantity, unit_volume_mm3, **kwargs)
+    else:
+        raise ValueError("Unsupported format. Use 'gzip' or 'binary'.")
+
+    written = 0
+    for data in chunks:
+        fileobj.write(data)
+        written += len(data)
+    return written
+
+
+def _iter_binary_lines(fileobj):
+    decompressor = zlib.decompressobj()
+    table = []
+    buf = b""
+    pos = 0
+
+    def read_varint():
+        nonlocal pos
+        n = shift = 0
+        while True:
+            if pos >= len(buf):
+                raise EOFError
+            byte = buf[pos]
+            pos += 1
+            n |= (byte & 0x7F) << shift
+            if not byte & 0x80:
+                return n
+            shift += 7
+
+    while True:
+        data = fileobj.read(READ_SIZE)
+        buf = buf[pos:] + (decompressor.decompress(data) if data else decompressor.flush())
+        pos = 0
+        while pos < len(buf):
+            start = pos
+            try:
+                index = read_varint()
+                if index:
+                    line = table[index - 1]
+                else:
+                    length = read_varint()
+                    if pos + length > len(buf):
+                        raise EOFError
+                    line = buf[pos:pos + length].decode("utf-8")
+                    pos += length
+                    if len(table) >= LINE_TABLE_SIZE:
+                        table.clear()
+                    table.append(line)
+            except EOFError:
+                # Record continues in the next block
+                pos = start
+                break
+            yield line
+        if not data:
+            if pos < len(buf):
+                raise ValueError("Truncated binary G-code stream.")
+            return
+
+
+class _Prefixed:
+    """Binary reader that replays already consumed bytes before the rest."""
+
+    def __init__(self, prefix: bytes, fileobj):
+        self.prefix = prefix
+        self.fileobj = fileobj
+
+    def read(self, size: int = -1) -> bytes:
+        if not self.prefix:
+            return self.fileobj.read(size)
+        if size is None or size < 0:
+            data, self.prefix = self.prefix + self.fileobj.read(), b""
+            return data
+        data, self.prefix = self.prefix[:size], self.prefix[size:]
+        if len(data) < size:
+            data += self.fileobj.read(size - len(data))
+        return data
+
+
+def iter_gcode_lines(source):
+    """
+    Yield the lines (without newlines) of a plain, gzip or binary G-code
+    program. `source` is a path or a binary file object; the format is
+    detected from its first bytes and the file is read incrementally.
+    """
+    if isinstance(source, (str, bytes)) or hasattr(source, "__fspath__"):
+        with open(source, "rb") as f:
+            yield from iter_gcode_lines(f)
+        return
+
+    head = source.read(len(MAGIC))
+    stream = _Prefixed(head, source)
+    if head.startswith(GZIP_MAGIC):
+        with gzip.GzipFile(fileobj=stream, mode="rb") as gz:
+            for raw in gz:
+                yield raw.decode("utf-8").rstrip("\r\n")
+    elif head == MAGIC:
+        yield from _iter_binary_lines(source)
+    else:
+        pending = b""
+        while True:
+            data = stream.read(READ_SIZE)
+            if not data:
+                break
+            lines = (pending + data).split(b"\n")
+            pending = lines.pop()
+            for raw in lines:
+                yield raw.decode("utf-8").rstrip("\r")
+        if pending:
+            yield pending.decode("utf-8").rstrip("\r")
@@ -0,0 +1,411 @@
+# gcode/estimate.py
+"""
+Print time and material estimates for generated G-code.
+
+Moves are timed with a trapezoidal velocity profile. Feedrates come from the
+program's F words and are capped by M203 (read as mm/min, the convention our
+headers use); accelerations come from M204 (P for printing moves, T for
+travel, R for extruder-only moves) capped per axis by M201 (mm/s^2).
+Consecutive moves keep speed through a junction in proportion to the cosine
+of the angle between them, and the planner comes to a full stop wherever that
+speed drops to zero (Z changes, retractions, reversals). Time and E/D usage
+are attributed to the unit named by the last ";Begin print table index:"
+comment. G2/G3 arcs are timed along their arc length. M98 calls are expanded
+into the O-numbered subprograms (up to M99) they call, and the main program
+ends at M30.
+"""
+
+import io
+import math
+
+from gcode.compress import iter_gcode_lines
+
+UNIT_MARKER = ";Begin print table index:"
+AXES = ("X", "Y", "Z", "E", "D")
+# Longest run of moves planned together when the program never stops
+PLANNER_LIMIT = 4096
+# Distinct parsed lines memoized before the cache is reset
+CACHE_SIZE = 200000
+# Deepest chain of M98 calls followed before giving up
+MAX_CALL_DEPTH = 8
+
+
+def _trapezoid_time(length: float, v_in: float, v_out: float, v_max: float, accel: float) -> float:
+    if length <= 0 or v_max <= 0:
+        return 0.0
+    if accel <= 0 or accel == math.inf:
+        return length / v_max
+    d_acc = (v_max * v_max - v_in * v_in) / (2 * accel)
+    d_dec = (v_max * v_max - v_out * v_out) / (2 * accel)
+    if d_acc + d_dec <= length:
+        return (2 * v_max - v_in - v_out) / accel + (length - d_acc - d_dec) / v_max
+    v_peak = math.sqrt(max((2 * accel * length + v_in * v_in + v_out * v_out) / 2, 0.0))
+    return max(v_peak - v_in, 0.0) / accel + max(v_peak - v_out, 0.0) / accel
+
+
+def _plan_run(lengths: list, speeds: list, accels: list, junctions: list) -> tuple:
+    """
+    Time a run of moves that starts and ends at rest, given each move's
+    length, top speed, acceleration and junction speed with the move before.
+    """
+    n = len(lengths)
+    entry = list(junctions) + [0.0]
+    entry[0] = 0.0
+    # Forward pass: limit each entry speed by what the previous move can reach
+    for i in range(1, n):
+        reach = math.sqrt(entry[i - 1] ** 2 + 2 * accels[i - 1] * lengths[i - 1])
+        if reach < entry[i]:
+            entry[i] = reach
+    # Backward pass: make sure every move can slow down for the next one
+    for i in range(n - 1, -1, -1):
+        reach = math.sqrt(entry[i + 1] ** 2 + 2 * accels[i] * lengths[i])
+        if reach < entry[i]:
+            entry[i] = reach
+    times = []
+    for i in range(n):
+        v_max = speeds[i]
+        times.append(_trapezoid_time(lengths[i], min(entry[i], v_max), min(entry[i + 1], v_max), v_max, accels[i]))
+    return tuple(times)
+
+
+def _parse(line: str) -> tuple:
+    """
+    Parse one line into ("move", x, y, z, e, d, f) with None for missing
+    words, ("arc", x, y, z, e, d, f, i, j, clockwise), ("unit", index), or
+    (command, params) for everything else.
+    """
+    code, _, comment = line.partition(";")
+    if not code.strip():
+        if (";" + comment).startswith(UNIT_MARKER):
+            try:
+                return ("unit", int(comment[len(UNIT_MARKER) - 1:].split()[0]))
+            except (ValueError, IndexError):
+                pass
+        return ("",)
+    words = code.split()
+    params = {}
+    for word in words[1:]:
+        try:
+            params[word[0].upper()] = float(word[1:])
+        except (ValueError, IndexError):
+            continue
+    cmd = words[0].upper()
+    if cmd in ("G0", "G1", "G00", "G01"):
+        return ("move",) + tuple(params.get(k) for k in ("X", "Y", "Z", "E", "D", "F"))
+    if cmd in ("G2", "G3", "G02", "G03"):
+        return (
+            ("arc",) + tuple(params.get(k) for k in ("X", "Y", "Z", "E", "D", "F"))
+            + (params.get("I", 0.0), params.get("J", 0.0), cmd in ("G2", "G02"))
+        )
+    return (cmd, params)
+
+
+def _call_lines(lines: list, subprograms: dict, depth: int):
+    for line in lines:
+        if line[:1] in ("M", "m"):
+            parsed = _parse(line)
+            if parsed[0] == "M98":
+                number = int(parsed[1].get("P", -1))
+                if number not in subprograms:
+                    raise ValueError(f"M98 calls undefined subprogram O{number}.")
+                if depth >= MAX_CALL_DEPTH:
+                    raise ValueError("Subprogram calls are nested too deeply.")
+                for _ in range(int(parsed[1].get("L", 1))):
+                    yield from _call_lines(subprograms[number], subprograms, depth + 1)
+                continue
+        yield line
+
+
+def _expand_subroutines(lines):
+    """
+    Yield the lines the printer executes: the main program up to M30, with
+    every M98 P<n> [L<count>] replaced by the body of subprogram O<n> (up to
+    its M99). Lines pass straight through until the first M98; from there the
+    main program is held back until the subprograms, which follow M30 in our
+    layout="subroutine" output, have been read.
+    """
+    subprograms = {}
+    current = None
+    main = None
+    ended = False
+    for line in lines:
+        command = _parse(line)[0] if line[:1] in ("M", "m", "O", "o") else ""
+        if current is not None:
+            if command == "M99":
+                current = None
+            else:
+                current.append(line)
+            continue
+        if command.startswith("O"):
+            try:
+                current = subprograms[int(command[1:])] = []
+            except ValueError:
+                pass
+            else:
+                continue
+        if ended:
+            continue
+        if command == "M30":
+            ended = True
+        elif main is not None:
+            main.append(line)
+        elif command == "M98":
+            main = [line]
+        else:
+            yield line
+    if current is not None:
+        raise ValueError("Subprogram is missing its M99.")
+    if main:
+        yield from _call_lines(main, subprograms, 0)
+
+
+def estimate_print(lines) -> dict:
+    """
+    Estimate print time and E/D usage for an iterable of G-code lines.
+    "lines" counts the lines executed, so subprogram bodies count once per
+    call.
+
+    Returns a dict with "time_s", "lines", "moves", E/D totals ("e_total",
+    "d_total" for extrusion and "e_retracted", "d_retracted" for retraction,
+    all in the program's E/D units) and "units", mapping each tray index to
+    its "time_s", "e_total" and "d_total".
+    """
+    inf = math.inf
+    sqrt = math.sqrt
+    units = {}
+    time_s = 0.0
+    n_lines = n_moves = 0
+    e_total = d_total = e_retracted = d_retracted = 0.0
+
+    x = y = z = e = d = 0.0
+    feed = 0.0         # mm/s
+    # Per-axis limits: mm/s (M203) and mm/s^2 (M201)
+    limits = {
+        "feed": dict.fromkeys(AXES, inf),
+        "accel": dict.fromkeys(AXES, inf),
+    }
+    fx = fy = fz = fe = fd = inf
+    ax = ay = az = ae = ad = inf
+    accel_print = accel_travel = accel_retract = inf
+    absolute = True
+    extruder_absolute = True
+    unit = None
+    unit_stats = None
+
+    # Planner buffer: parallel lists of move length, max speed, acceleration,
+    # junction speed with the previous move and owning unit stats
+    buf_len, buf_v, buf_a, buf_j, buf_u = [], [], [], [], []
+    prev_dir = None
+    prev_v = 0.0
+
+    run_times = {}
+
+    def flush():
+        nonlocal time_s
+        if not buf_len:
+            return
+        # Runs between stops repeat for every layer, so reuse their timing
+        key = (tuple(buf_len), tuple(buf_v), tuple(buf_a), tuple(buf_j))
+        times = run_times.get(key)
+        if times is None:
+            times = _plan_run(buf_len, buf_v, buf_a, buf_j)
+            if len(run_times) >= CACHE_SIZE:
+                run_times.clear()
+            run_times[key] = times
+        total = 0.0
+        for t, stats in zip(times, buf_u):
+            total += t
+            if stats is not None:
+                stats["time_s"] += t
+        time_s += total
+        buf_len.clear(); buf_v.clear(); buf_a.clear(); buf_j.clear(); buf_u.clear()
+
+    parsed_lines = {}
+    for line in _expand_subroutines(lines):
+        n_lines += 1
+        parsed = parsed_lines.get(line)
+        if parsed is None:
+            parsed = _parse(line)
+            if len(parsed_lines) >= CACHE_SIZE:
+                parsed_lines.clear()
+            parsed_lines[line] = parsed
+        kind = parsed[0]
+
+        if kind == "move" or kind == "arc":
+            px, py, pz, pe, pd, pf = parsed[1:7]
+            if pf is not None:
+                feed = pf / 60
+            if absolute:
+                dx = 0.0 if px is None else px - x
+                dy = 0.0 if py is None else py - y
+                dz = 0.0 if pz is None else pz - z
+            else:
+                dx, dy, dz = px or 0.0, py or 0.0, pz or 0.0
+            if extruder_absolute:
+                de = 0.0 if pe is None else pe - e
+                dd = 0.0 if pd is None else pd - d
+            else:
+                de, dd = pe or 0.0, pd or 0.0
+            x += dx
+            y += dy
+            z += dz
+            e += de
+            d += dd
+
+            if de > 0:
+                e_total += de
+                if unit_stats is not None:
+                    unit_stats["e_total"] += de
+            elif de < 0:
+                e_retracted -= de
+            if dd > 0:
+                d_total += dd
+                if unit_stats is not None:
+                    unit_stats["d_total"] += dd
+            elif dd < 0:
+                d_retracted -= dd
+
+            if kind == "arc":
+                # Start and end points relative to the arc centre (I/J)
+                ux, uy = -parsed[7], -parsed[8]
+                vx, vy = ux + dx, uy + dy
+                radius = sqrt(ux * ux + uy * uy)
+                sweep = math.atan2(ux * vy - uy * vx, ux * vx + uy * vy)
+                turn = -1.0 if parsed[9] else 1.0
+                sweep *= turn
+                if sweep <= 1e-9:
+                    sweep += 2 * math.pi
+                arc_length = radius * sweep
+                length = sqrt(arc_length * arc_length + dz * dz)
+            else:
+                length = sqrt(dx * dx + dy * dy + dz * dz)
+            if length > 0:
+                accel = accel_print if (de > 0 or dd > 0) else accel_travel
+                if kind == "arc" and radius > 0:
+                    # Tangents at the start (for this junction) and the end
+                    k = turn * arc_length / (radius * length)
+                    direction = (-uy * k, ux * k, dz / length)
+                    end_direction = (-vy * k, vx * k, dz / length)
+                else:
+                    direction = end_direction = (dx / length, dy / length, dz / length)
+            else:
+                length = abs(de) if abs(de) > abs(dd) else abs(dd)
+                if length == 0:
+                    continue
+                accel = accel_retract
+                direction = end_direction = None
+
+            # Cap speed and acceleration so no axis exceeds its own limit
+            v_max = feed or inf
+            if dx:
+                scale = length / abs(dx)
+                if fx * scale < v_max:
+                    v_max = fx * scale
+                if ax * scale < accel:
+                    accel = ax * scale
+            if dy:
+                scale = length / abs(dy)
+                if fy * scale < v_max:
+                    v_max = fy * scale
+                if ay * scale < accel:
+                    accel = ay * scale
+            if dz:
+                scale = length / abs(dz)
+                if fz * scale < v_max:
+                    v_max = fz * scale
+                if az * scale < accel:
+                    accel = az * scale
+            if de:
+                scale = length / abs(de)
+                if fe * scale < v_max:
+                    v_max = fe * scale
+                if ae * scale < accel:
+                    accel = ae * scale
+            if dd:
+                scale = length / abs(dd)
+                if fd * scale < v_max:
+                    v_max = fd * scale
+                if ad * scale < accel:
+                    accel = ad * scale
+            if v_max == inf:
+                continue
+            n_moves += 1
+
+            junction = 0.0
+            if buf_len:
+                if direction is not None and prev_dir is not None:
+                    cos = direction[0] * prev_dir[0] + direction[1] * prev_dir[1] + direction[2] * prev_dir[2]
+                    if cos > 0:
+                        junction = (prev_v if prev_v < v_max else v_max) * cos
+                if junction <= 0 or len(buf_len) >= PLANNER_LIMIT:
+                    flush()
+                    junction = 0.0
+            buf_len.append(length)
+            buf_v.append(v_max)
+            buf_a.append(accel)
+            buf_j.append(junction)
+            buf_u.append(unit_stats)
+            prev_dir = end_direction
+            prev_v = v_max
+        elif kind == "unit":
+            unit = parsed[1]
+            unit_stats = units.setdefault(unit, {"time_s": 0.0, "e_total": 0.0, "d_total": 0.0})
+        elif kind == "":
+            continue
+        else:
+            params = parsed[1]
+            if kind == "G4":
+                flush()
+                dwell = params.get("P", 0.0) / 1000 + params.get("S", 0.0)
+                time_s += dwell
+                if unit_stats is not None:
+                    unit_stats["time_s"] += dwell
+            elif kind == "G28":
+                flush()
+                x = y = z = 0.0
+            elif kind == "G90":
+                absolute = extruder_absolute = True
+            elif kind == "G91":
+                absolute = extruder_absolute = False
+            elif kind == "M82":
+                extruder_absolute = True
+            elif kind == "M83":
+                extruder_absolute = False
+            elif kind == "G92":
+                x = params.get("X", x)
+                y = params.get("Y", y)
+                z = params.get("Z", z)
+                e = params.get("E", e)
+                d = params.get("D", d)
+            elif kind in ("M201", "M203"):
+                table = limits["accel" if kind == "M201" else "feed"]
+                for axis in AXES:
+                    if axis in params:
+                        table[axis] = params[axis] if kind == "M201" else params[axis] / 60
+                fx, fy, fz, fe, fd = (limits["feed"][a] for a in AXES)
+                ax, ay, az, ae, ad = (limits["accel"][a] for a in AXES)
+            elif kind == "M204":
+                accel_print = params.get("P", accel_print)
+                accel_travel = params.get("T", accel_travel)
+                accel_retract = params.get("R", accel_retract)
+
+    flush()
+    return {
+        "time_s": time_s, "lines": n_lines, "moves": n_moves,
+        "e_total": e_total, "d_total": d_total,
+        "e_retracted": e_retracted, "d_retracted": d_retracted,
+        "units": units
+    }
+
+
+def estimate_print_text(program: str) -> dict:
+    """Estimate a G-code program held in a string."""
+    return estimate_print(line.rstrip("\n") for line in io.StringIO(program))
+
+
+def estimate_print_file(source) -> dict:
+    """
+    Estimate a G-code file from a path or binary file object. Plain, gzip and
+    binary programs are read incrementally (see gcode.compress).
+    """
+    return estimate_print(iter_gcode_lines(source))
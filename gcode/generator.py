@@ -1,92 +1,570 @@
 # gcode/generator.py
 
-import math
-from gcode.shapes import generate_circle, generate_oval, generate_caplet
+from gcode.shapes import ShapePath, get_shape_path
+from gcode.infill import get_infill_path
+from gcode.arcs import fit_arcs
+from gcode.layers import get_layer_heights, get_retraction_commands
+from gcode.tray import get_columns, get_xy_offset, get_comment, get_traversal_order, plan_traversal
+from gcode import metrics
 
-def generate_gcode(
+HEADER = [
+    "; Craft Health G-code",
+    "G21", "G90", "G28", "M83"
+]
+
+HEADER_END = [
+    "J11 W1 Z1",
+    ""
+]
+
+# Header motion limits: (command, key in the printer registry's "motion"
+# section, words used if the registry does not set them)
+MOTION_COMMANDS = [
+    ("M201", "max_acceleration_mm_s2", {"E": 8000, "D": 8000, "X": 1000, "Y": 1000, "Z": 200, "W": 200}),
+    ("M203", "max_feedrate_mm_min", {"X": 100000, "Y": 100000, "E": 8000, "D": 8000}),
+    ("M204", "acceleration_mm_s2", {"P": 4000, "R": 4000, "T": 1000})
+]
+# Feedrate (mm/min) of travel moves and Z lifts if the registry does not set one
+DEFAULT_TRAVEL_FEEDRATE = 3000
+
+FOOTER = [
+    "M104 S0",
+    "M140 S0",
+    "M84"
+]
+
+# Program number of the unit subroutine in layout="subroutine"
+SUBROUTINE_ID = 1000
+
+
+def _unit_template(
+    path: ShapePath,
+    tablet_height: float,
+    layer_height: float,
+    line_width: float,
+    volume_scale: float,
+    head_mode: str,
+    arc_tolerance: float = None
+) -> tuple:
+    """
+    Precompute the parts of a unit block that do not depend on its tray
+    position: the moves as (command, x, y, suffix) relative to the unit
+    origin, with their E/D (and arc I/J) suffixes, and the Z lines.
+    """
+    volumes = [dist * line_width * layer_height * volume_scale for dist in path.segment_lengths]
+    if arc_tolerance is None:
+        runs = [(j, j + 1, None) for j in range(len(volumes))]
+    else:
+        runs = fit_arcs(path.points, arc_tolerance)
+
+    moves = []
+    for start, end, arc in runs:
+        # An arc extrudes exactly what the chords it replaces would have
+        vol = sum(volumes[start:end])
+
+        e_val = vol if head_mode == "Single Head" else vol / 2
+        d_val = 0 if head_mode == "Single Head" else vol / 2
+
+        command = "G1"
+        suffix = ""
+        if arc:
+            cx, cy, clockwise = arc
+            x0, y0 = path.points[start]
+            command = "G2" if clockwise else "G3"
+            suffix = f" I{cx - x0:.3f} J{cy - y0:.3f}"
+        if e_val: suffix += f" E{e_val:.3f}"
+        if d_val: suffix += f" D{d_val:.3f}"
+        x, y = path.points[end]
+        moves.append((command, x, y, suffix))
+
+    z_lines = [f"G1 Z{z:.2f} F1500" for z in get_layer_heights(tablet_height, layer_height)]
+    return moves, z_lines
+
+
+def _unit_moves(moves: list, offset_x: float, offset_y: float) -> list:
+    return [
+        f"{command} X{offset_x + x:.2f} Y{offset_y + y:.2f}{suffix}"
+        for command, x, y, suffix in moves
+    ]
+
+
+def _is_closed(unit_moves: list, start_point: tuple) -> bool:
+    """Whether the path ends where it starts, at the output precision."""
+    _, end_x, end_y, _ = unit_moves[-1]
+    return [round(v * 100) for v in start_point] == [round(end_x * 100), round(end_y * 100)]
+
+
+def _unit_blocks(template: tuple, start_point: tuple, sequence: list, cols: int, spacing: float, travel_feed: str):
+    unit_moves, z_lines = template
+    retraction = get_retraction_commands(2, 2)
+    x0, y0 = start_point
+    closed = _is_closed(unit_moves, start_point)
+    # Arcs are relative to the current position and an open path (infill)
+    # ends away from its start, so those need a real travel to the start;
+    # a plain closed outline keeps the original compact blocks
+    travel = not closed or any(command != "G1" for command, _, _, _ in unit_moves)
+
+    for i in sequence:
+        offset_x, offset_y = get_xy_offset(i, spacing, cols)
+
+        # XY moves are identical for every layer of a unit; only Z changes
+        moves = _unit_moves(unit_moves, offset_x, offset_y)
+        layer_body = "\n".join(moves + retraction)
+
+        block = [get_comment(i, offset_x, offset_y)]
+        if travel:
+            travel_line = f"G1 X{offset_x + x0:.2f} Y{offset_y + y0:.2f} {travel_feed}"
+            block += [f"G1 Z5 {travel_feed}", travel_line]
+            # Later layers of an open path travel back to the start first
+            later_body = layer_body if closed else f"{travel_line}\nG1 F1500\n{layer_body}"
+            block.append(z_lines[0] + "\n" + layer_body)
+            block += [z_line + "\n" + later_body for z_line in z_lines[1:]]
+        else:
+            block += [z_line + "\n" + layer_body for z_line in z_lines]
+        block.append(f"G1 Z5 {travel_feed}")
+        yield "\n".join(block) + "\n"
+
+
+def _relative_layer_body(unit_moves: list, start_point: tuple, travel_from: tuple = None, travel_feed: str = None) -> str:
+    """
+    One layer of a unit as G91 moves from its start point, after a travel
+    from `travel_from` if given. Steps are taken between coordinates rounded
+    to the output precision, so they sum back to the same absolute positions
+    and a closed path returns exactly to start.
+    """
+    prev_x, prev_y = (round(v * 100) for v in start_point)
+    lines = ["G91"]
+    if travel_from is not None:
+        from_x, from_y = (round(v * 100) for v in travel_from)
+        lines += [f"G1 X{(prev_x - from_x) / 100:.2f} Y{(prev_y - from_y) / 100:.2f} {travel_feed}", "G1 F1500"]
+    for command, x, y, suffix in unit_moves:
+        cur_x, cur_y = round(x * 100), round(y * 100)
+        lines.append(f"{command} X{(cur_x - prev_x) / 100:.2f} Y{(cur_y - prev_y) / 100:.2f}{suffix}")
+        prev_x, prev_y = cur_x, cur_y
+    # Some firmware resets E to absolute on G90, so re-assert relative E
+    lines += ["G90", "M83"]
+    return "\n".join(lines + get_retraction_commands(2, 2))
+
+
+def _unit_stack(template: tuple, start_point: tuple, travel_feed: str) -> list:
+    """The full layer stack of a unit in relative coordinates."""
+    unit_moves, z_lines = template
+    first_body = _relative_layer_body(unit_moves, start_point)
+    # Later layers of an open path (infill) travel back to the start first
+    # rather than extruding from where the previous layer ended
+    _, end_x, end_y, _ = unit_moves[-1]
+    if _is_closed(unit_moves, start_point):
+        layer_body = first_body
+    else:
+        layer_body = _relative_layer_body(unit_moves, start_point, (end_x, end_y), travel_feed)
+    bodies = [first_body] + [layer_body] * (len(z_lines) - 1)
+    return [z_line + "\n" + body for z_line, body in zip(z_lines, bodies)] + [f"G1 Z5 {travel_feed}"]
+
+
+def _relative_blocks(
+    template: tuple, start_point: tuple, sequence: list, cols: int, spacing: float, call: bool, travel_feed: str
+):
+    x0, y0 = start_point
+    # Every unit shares the same relative stack; only the travel differs
+    stack = f"M98 P{SUBROUTINE_ID}" if call else "\n".join(_unit_stack(template, start_point, travel_feed))
+
+    for i in sequence:
+        offset_x, offset_y = get_xy_offset(i, spacing, cols)
+        yield (
+            f"{get_comment(i, offset_x, offset_y)}\n"
+            f"G1 Z5 {travel_feed}\n"
+            f"G1 X{offset_x + x0:.2f} Y{offset_y + y0:.2f} {travel_feed}\n"
+            f"{stack}\n"
+        )
+
+
+def _layer_blocks(template: tuple, start_point: tuple, sequence: list, cols: int, spacing: float, travel_feed: str):
+    unit_moves, z_lines = template
+    retraction = get_retraction_commands(2, 2)
+    x0, y0 = start_point
+
+    # Each unit's layer body (travel to its start, moves, retraction) is the
+    # same on every layer, so build them once and reuse them per Z
+    unit_bodies = []
+    for i in sequence:
+        offset_x, offset_y = get_xy_offset(i, spacing, cols)
+        block = [
+            get_comment(i, offset_x, offset_y),
+            f"G1 X{offset_x + x0:.2f} Y{offset_y + y0:.2f} {travel_feed}",
+            "G1 F1500"
+        ]
+        block += _unit_moves(unit_moves, offset_x, offset_y)
+        block += retraction
+        unit_bodies.append("\n".join(block))
+    layer_body = "\n".join(unit_bodies)
+
+    for layer, z_line in enumerate(z_lines):
+        yield f";Begin layer:{layer + 1}\n{z_line}\n{layer_body}\n"
+    yield f"G1 Z5 {travel_feed}\n"
+
+
+def _prepare(
     quantity: int,
+    unit_volume_mm3: float,
+    shape: str,
+    layer_height: float,
+    tablet_height: float,
+    line_width: float,
+    head_mode: str,
+    traversal: str,
+    order: list,
+    infill: str,
+    arc_tolerance: float,
+    positions: list = None
+) -> tuple:
+    num_layers = int(tablet_height / layer_height)
+
+    # Generate shape path
+    with metrics.span("gcode.shape"):
+        if infill == "none":
+            path = get_shape_path(shape)
+        elif infill == "concentric":
+            path = get_infill_path(shape, line_width)
+        else:
+            raise ValueError("Unsupported infill. Use 'none' or 'concentric'.")
+
+    # Calculate scaling factor to match unit volume
+    with metrics.span("gcode.volume_scaling"):
+        layer_volume = path.perimeter * line_width * layer_height
+        total_path_volume = layer_volume * num_layers
+        volume_scale = unit_volume_mm3 / total_path_volume if total_path_volume > 0 else 1
+
+        template = _unit_template(
+            path, tablet_height, layer_height, line_width, volume_scale, head_mode, arc_tolerance
+        )
+    cols = get_columns(quantity)
+    if positions is not None:
+        return path, template, list(positions), cols
+    return path, template, get_traversal_order(quantity, cols, traversal, order), cols
+
+
+def iter_unit_blocks(
+    quantity: int,
+    unit_volume_mm3: float,
+    shape: str = "circle",
+    layer_height: float = 0.3,
+    tablet_height: float = 3.6,
+    line_width: float = 0.6,
+    head_mode: str = "Single Head",
+    spacing: float = 24.0,
+    traversal: str = "row-major",
+    order: list = None,
+    infill: str = "none",
+    arc_tolerance: float = None,
+    layout: str = "expanded",
+    start: int = 0,
+    stop: int = None,
+    positions: list = None,
+    travel_feedrate: float = None
+):
+    """
+    Return an iterator over the G-code blocks of print positions start..stop-1
+    of a `quantity`-unit tray, visited in the given traversal order (see
+    gcode.tray.get_traversal_order). Index numbering and offsets match the
+    full program, so consecutive ranges can be generated separately and
+    concatenated. With infill="concentric" each layer is filled with
+    line_width-spaced loops (see gcode.infill) rather than only the outline.
+    Setting arc_tolerance (mm) replaces runs of chords with G2/G3 arcs (see
+    gcode.arcs) carrying the same E/D volume.
+
+    layout="relative" travels to each unit's start and prints its layers as
+    G91 moves, so every unit block is textually identical apart from that
+    travel. layout="subroutine" replaces the layers with an M98 call to the
+    subroutine from subroutine_definition.
+
+    `positions` gives the tray indices to render directly, in print order,
+    instead of computing the traversal and slicing it with start/stop; pass
+    a slice of a traversal computed once to render a range without redoing
+    the whole tour. Travel moves and Z lifts run at `travel_feedrate`
+    (mm/min; by default get_travel_feedrate()).
+    """
+    path, template, sequence, cols = _prepare(
+        quantity, unit_volume_mm3, shape, layer_height, tablet_height,
+        line_width, head_mode, traversal, order, infill, arc_tolerance, positions
+    )
+    if positions is None:
+        sequence = sequence[start:stop]
+    travel_feed = _feed_word(travel_feedrate)
+    if layout == "expanded":
+        return _unit_blocks(template, path.points[0], sequence, cols, spacing, travel_feed)
+    if layout in ("relative", "subroutine"):
+        return _relative_blocks(
+            template, path.points[0], sequence, cols, spacing, layout == "subroutine", travel_feed
+        )
+    raise ValueError("Unsupported layout. Use 'expanded', 'relative' or 'subroutine'.")
+
+
+def subroutine_definition(
     unit_volume_mm3: float,
     shape: str = "circle",
     layer_height: float = 0.3,
     tablet_height: float = 3.6,
     line_width: float = 0.6,
     head_mode: str = "Single Head",
-    spacing: float = 24.0
+    infill: str = "none",
+    arc_tolerance: float = None,
+    travel_feedrate: float = None
 ) -> str:
     """
-    Generate Craft Health-compatible G-code for a given shape.
+    Return the O-numbered subroutine (O{SUBROUTINE_ID} ... M99) that prints
+    one unit in relative coordinates from its start point.
     """
-    num_layers = int(tablet_height / layer_height)
+    path, template, _, _ = _prepare(
+        0, unit_volume_mm3, shape, layer_height, tablet_height,
+        line_width, head_mode, "row-major", None, infill, arc_tolerance
+    )
+    stack = _unit_stack(template, path.points[0], _feed_word(travel_feedrate))
+    return "\n".join([f"O{SUBROUTINE_ID}"] + stack + ["M99"])
 
-    # Generate shape path
-    if shape == "circle":
-        path = generate_circle()
-    elif shape == "oval":
-        path = generate_oval()
-    elif shape == "caplet":
-        path = generate_caplet()
-    else:
-        raise ValueError("Unsupported shape. Add support in shapes.py.")
 
-    # Calculate scaling factor to match unit volume
-    perim = sum(
-        math.dist(path[i], path[i + 1])
-        for i in range(len(path) - 1)
+def iter_layer_blocks(
+    quantity: int,
+    unit_volume_mm3: float,
+    shape: str = "circle",
+    layer_height: float = 0.3,
+    tablet_height: float = 3.6,
+    line_width: float = 0.6,
+    head_mode: str = "Single Head",
+    spacing: float = 24.0,
+    traversal: str = "row-major",
+    order: list = None,
+    infill: str = "none",
+    arc_tolerance: float = None,
+    positions: list = None,
+    travel_feedrate: float = None
+):
+    """
+    Return an iterator over tray-wide layer blocks: layer N of every unit is
+    printed before any unit moves to layer N+1, so Z changes once per layer
+    instead of once per unit and layer. Each unit layer starts with a travel
+    to the unit's path start and ends with the usual retraction. As in
+    iter_unit_blocks, `positions` replaces the computed traversal and
+    `travel_feedrate` sets the travel speed.
+    """
+    path, template, sequence, cols = _prepare(
+        quantity, unit_volume_mm3, shape, layer_height, tablet_height,
+        line_width, head_mode, traversal, order, infill, arc_tolerance, positions
     )
-    layer_volume = perim * line_width * layer_height
-    total_path_volume = layer_volume * num_layers
-    volume_scale = unit_volume_mm3 / total_path_volume if total_path_volume > 0 else 1
-
-    # Header G-code
-    gcode = [
-        "; Craft Health G-code",
-        "G21", "G90", "G28", "M83",
-        "M201 E8000 D8000 X1000 Y1000 Z200 W200",
-        "M203 X100000 Y100000 E8000 D8000",
-        "M204 P4000 R4000 T1000",
-        "J11 W1 Z1",
-        ""
-    ]
+    return _layer_blocks(template, path.points[0], sequence, cols, spacing, _feed_word(travel_feedrate))
+
+
+def get_motion(motion=None):
+    """`motion` if given, else the printer "motion" section of the shared registry."""
+    if motion is None:
+        from utils.registry import get_section
+
+        motion = get_section("printer").get("motion", {})
+    return motion
+
+
+def get_travel_feedrate(motion=None) -> float:
+    """Travel feedrate (mm/min) from a printer "motion" section (see get_motion)."""
+    return float(get_motion(motion).get("travel_feedrate_mm_min", DEFAULT_TRAVEL_FEEDRATE))
+
+
+def _number(value) -> str:
+    value = float(value)
+    return str(int(value)) if value.is_integer() else str(value)
 
-    cols = int(math.ceil(math.sqrt(quantity)))
 
-    for i in range(quantity):
-        row = i // cols
-        col = i % cols
-        offset_x = col * spacing
-        offset_y = row * spacing
+def _feed_word(travel_feedrate: float = None) -> str:
+    return "F" + _number(get_travel_feedrate() if travel_feedrate is None else travel_feedrate)
+
+
+def motion_commands(motion=None) -> list:
+    """
+    The M201/M203/M204 limit lines for the header, from `motion` (a printer
+    "motion" section) or, by default, the shared registry (Config/printer.json).
+    """
+    motion = get_motion(motion)
+    lines = []
+    for command, key, default in MOTION_COMMANDS:
+        words = [command]
+        for letter, value in motion.get(key, default).items():
+            words.append(f"{letter}{_number(value)}")
+        lines.append(" ".join(words))
+    return lines
+
+
+def program_header(
+    quantity: int,
+    spacing: float = 24.0,
+    traversal: str = "row-major",
+    order: list = None,
+    sequence: list = None,
+    motion=None,
+    travel_feedrate: float = None
+) -> str:
+    """
+    Return the start G-code, with motion limits from motion_commands(motion).
+    Non row-major traversals add a comment with the travel saved against
+    row-major order (computed from `sequence` if the caller already has it),
+    timed at `travel_feedrate` (default: the one in `motion`).
+    """
+    motion = get_motion(motion)
+    header = HEADER + motion_commands(motion) + HEADER_END
+    if traversal != "row-major":
+        if travel_feedrate is None:
+            travel_feedrate = get_travel_feedrate(motion)
+        plan = plan_traversal(
+            quantity, spacing, traversal, order, travel_feedrate=travel_feedrate, sequence=sequence
+        )
+        header.insert(-1, (
+            f"; Traversal: {traversal}  travel {plan['travel_mm']:.1f} mm"
+            f"  saved {plan['saved_mm']:.1f} mm (~{plan['saved_s']:.1f} s)"
+        ))
+    return "\n".join(header) + "\n"
 
-        gcode.append(f";Begin print table index:{i+1}  Parameter offset x{offset_x}  y{offset_y}")
 
-        for layer in range(num_layers):
-            z = (layer + 1) * layer_height
-            gcode.append(f"G1 Z{z:.2f} F1500")
+def iter_gcode(
+    quantity: int,
+    unit_volume_mm3: float,
+    shape: str = "circle",
+    layer_height: float = 0.3,
+    tablet_height: float = 3.6,
+    line_width: float = 0.6,
+    head_mode: str = "Single Head",
+    spacing: float = 24.0,
+    traversal: str = "row-major",
+    order: list = None,
+    schedule: str = "unit",
+    infill: str = "none",
+    arc_tolerance: float = None,
+    layout: str = "expanded",
+    travel_feedrate: float = None
+):
+    """
+    Yield Craft Health-compatible G-code as text chunks: the header, one block
+    per tray unit (or per tray-wide layer with schedule="layer"), then the
+    footer. Joining the chunks gives the same program as generate_gcode, but
+    only one block is held in memory at a time.
 
-            for j in range(len(path) - 1):
-                x1 = offset_x + path[j+1][0]
-                y1 = offset_y + path[j+1][1]
-                dist = math.dist(path[j], path[j+1])
-                vol = dist * line_width * layer_height * volume_scale
+    layout="subroutine" defines the unit once as an O-numbered subroutine
+    after the main program (which ends in M30) and calls it with M98 at each
+    tray position, for firmware that supports M98/M99 subprograms.
+    layout="relative" keeps one self-contained file with G91 unit blocks.
 
-                e_val = vol if head_mode == "Single Head" else vol / 2
-                d_val = 0 if head_mode == "Single Head" else vol / 2
+    Motion limits and the travel feedrate come from the printer registry
+    (Config/printer.json) unless `travel_feedrate` (mm/min) is given.
+    """
+    footer = FOOTER
+    # The header and the blocks share one traversal and one set of settings
+    sequence = get_traversal_order(quantity, get_columns(quantity), traversal, order)
+    motion = get_motion()
+    if travel_feedrate is None:
+        travel_feedrate = get_travel_feedrate(motion)
+    if schedule == "unit":
+        blocks = iter_unit_blocks(
+            quantity,
+            unit_volume_mm3,
+            shape=shape,
+            layer_height=layer_height,
+            tablet_height=tablet_height,
+            line_width=line_width,
+            head_mode=head_mode,
+            spacing=spacing,
+            traversal=traversal,
+            order=order,
+            infill=infill,
+            arc_tolerance=arc_tolerance,
+            layout=layout,
+            positions=sequence,
+            travel_feedrate=travel_feedrate
+        )
+        if layout == "subroutine":
+            footer = FOOTER + ["M30", subroutine_definition(
+                unit_volume_mm3, shape, layer_height, tablet_height,
+                line_width, head_mode, infill, arc_tolerance, travel_feedrate
+            )]
+    elif schedule == "layer":
+        if layout != "expanded":
+            raise ValueError("The layer schedule only supports the expanded layout.")
+        blocks = iter_layer_blocks(
+            quantity,
+            unit_volume_mm3,
+            shape=shape,
+            layer_height=layer_height,
+            tablet_height=tablet_height,
+            line_width=line_width,
+            head_mode=head_mode,
+            spacing=spacing,
+            traversal=traversal,
+            order=order,
+            infill=infill,
+            arc_tolerance=arc_tolerance,
+            positions=sequence,
+            travel_feedrate=travel_feedrate
+        )
+    else:
+        raise ValueError("Unsupported schedule. Use 'unit' or 'layer'.")
 
-                move = f"G1 X{x1:.2f} Y{y1:.2f}"
-                if e_val: move += f" E{e_val:.3f}"
-                if d_val: move += f" D{d_val:.3f}"
-                gcode.append(move)
+    metrics.count("gcode.programs")
+    metrics.count("gcode.units", quantity)
+    metrics.count("gcode.layers", quantity * len(get_layer_heights(tablet_height, layer_height)))
+    yield from metrics.timed_chunks("gcode.emit", _program_chunks(
+        program_header(quantity, spacing, traversal, order, sequence, motion, travel_feedrate), blocks, footer
+    ), "gcode")
 
-            gcode.append("G1 E-2 D-2 F1800")
-            gcode.append("G92 E0")
-            gcode.append("G92 D0")
 
-        gcode.append("G1 Z5 F3000")
+def _program_chunks(header: str, blocks, footer: list):
+    yield header
+    yield from blocks
 
     # End G-code
-    gcode += [
-        "M104 S0",
-        "M140 S0",
-        "M84"
-    ]
+    yield "\n".join(footer)
 
-    return "\n".join(gcode)
+
+def write_gcode(fileobj, quantity: int, unit_volume_mm3: float, **kwargs) -> int:
+    """
+    Stream G-code into a writable text file object. Returns the number of
+    characters written.
+    """
+    written = 0
+    for chunk in iter_gcode(quantity, unit_volume_mm3, **kwargs):
+        fileobj.write(chunk)
+        written += len(chunk)
+    return written
+
+
+def generate_gcode(
+    quantity: int,
+    unit_volume_mm3: float,
+    shape: str = "circle",
+    layer_height: float = 0.3,
+    tablet_height: float = 3.6,
+    line_width: float = 0.6,
+    head_mode: str = "Single Head",
+    spacing: float = 24.0,
+    traversal: str = "row-major",
+    order: list = None,
+    schedule: str = "unit",
+    infill: str = "none",
+    arc_tolerance: float = None,
+    layout: str = "expanded",
+    travel_feedrate: float = None
+) -> str:
+    """
+    Generate Craft Health-compatible G-code for a given shape.
+    """
+    return "".join(iter_gcode(
+        quantity,
+        unit_volume_mm3,
+        shape=shape,
+        layer_height=layer_height,
+        tablet_height=tablet_height,
+        line_width=line_width,
+        head_mode=head_mode,
+        spacing=spacing,
+        traversal=traversal,
+        order=order,
+        schedule=schedule,
+        infill=infill,
+        arc_tolerance=arc_tolerance,
+        layout=layout,
+        travel_feedrate=travel_feedrate
+    ))
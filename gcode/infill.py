@@ -0,0 +1,54 @@
+# gcode/infill.py
+
+from functools import lru_cache
+
+from gcode.shapes import SHAPE_CACHE_SIZE, SHAPES, ShapePath, path_from_points
+
+
+def _offset_dims(shape: str, dims: dict, offset: float) -> dict:
+    """Dimensions of the outline shrunk inwards by `offset` mm."""
+    if shape == "circle":
+        return dict(dims, radius=dims["radius"] - offset)
+    return dict(dims, length=dims["length"] - 2 * offset, width=dims["width"] - 2 * offset)
+
+
+def _half_width(shape: str, dims: dict) -> float:
+    return dims["radius"] if shape == "circle" else dims["width"] / 2
+
+
+@lru_cache(maxsize=SHAPE_CACHE_SIZE)
+def _cached_infill_path(shape: str, line_width: float, dims: tuple) -> ShapePath:
+    builder, defaults = SHAPES[shape]
+    outline = dict(defaults, **dict(dims))
+
+    # Circles and caplets shrink exactly; ovals use concentric ellipses,
+    # which keep line_width spacing on both axes without self-intersecting
+    points = []
+    k = 0
+    while True:
+        loop_dims = _offset_dims(shape, outline, k * line_width)
+        if _half_width(shape, loop_dims) < line_width / 2:
+            break
+        # Each loop starts at angle 0, so the step in from the previous loop
+        # is a single line_width move across already-filled area
+        points += builder(**loop_dims)
+        k += 1
+    return path_from_points(points or builder(**outline))
+
+
+def get_infill_path(shape: str, line_width: float = 0.6, **dims) -> ShapePath:
+    """
+    Return a concentric fill for a shape: the outline followed by inward
+    loops spaced `line_width` apart, joined into one continuous path. Paths
+    are cached per (shape, line_width, dimensions).
+    """
+    if shape not in SHAPES:
+        raise ValueError("Unsupported shape. Add support in shapes.py.")
+    if line_width <= 0:
+        raise ValueError("line_width must be positive.")
+    return _cached_infill_path(shape, line_width, tuple(sorted(dims.items())))
+
+
+def clear_infill_cache():
+    """Drop all cached infill paths."""
+    _cached_infill_path.cache_clear()
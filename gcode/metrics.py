@@ -0,0 +1,156 @@
+# gcode/metrics.py
+"""
+Switchable timing spans and counters for the generation hot paths.
+
+Metrics are off by default (set CRAFTHEALTH_METRICS=1 or call enable()).
+While off, span() returns a shared no-op context manager and count() returns
+immediately, so instrumented code pays one function call and a flag check.
+Collected values are process-wide and can be exported with to_json() or
+to_prometheus().
+"""
+
+import os
+import threading
+import time
+
+PROMETHEUS_PREFIX = "crafthealth"
+
+_enabled = os.environ.get("CRAFTHEALTH_METRICS", "") not in ("", "0")
+_spans = {}
+_counters = {}
+_lock = threading.Lock()
+
+
+class _NoSpan:
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        return False
+
+
+_NO_SPAN = _NoSpan()
+
+
+class _Span:
+    def __init__(self, name: str):
+        self.name = name
+
+    def __enter__(self):
+        self.start = time.perf_counter()
+        return self
+
+    def __exit__(self, *exc):
+        record_span(self.name, time.perf_counter() - self.start)
+        return False
+
+
+def enable(flag: bool = True):
+    global _enabled
+    _enabled = flag
+
+
+def is_enabled() -> bool:
+    return _enabled
+
+
+def span(name: str):
+    """Context manager timing a block under `name` (no-op while disabled)."""
+    return _Span(name) if _enabled else _NO_SPAN
+
+
+def record_span(name: str, seconds: float):
+    with _lock:
+        stats = _spans.get(name)
+        if stats is None:
+            _spans[name] = {"count": 1, "total_s": seconds, "max_s": seconds}
+        else:
+            stats["count"] += 1
+            stats["total_s"] += seconds
+            stats["max_s"] = max(stats["max_s"], seconds)
+
+
+def count(name: str, value: float = 1):
+    """Add `value` to counter `name` (no-op while disabled)."""
+    if not _enabled:
+        return
+    with _lock:
+        _counters[name] = _counters.get(name, 0) + value
+
+
+def timed_chunks(name: str, chunks, counter_prefix: str = None):
+    """
+    Yield from a generator of text chunks, timing the work done inside it
+    (not in the consumer) under span `name`, and counting lines and bytes
+    as `<counter_prefix>.lines` / `.bytes`. Pass-through while disabled.
+    """
+    if not _enabled:
+        yield from chunks
+        return
+    elapsed = 0.0
+    lines = size = 0
+    chunks = iter(chunks)
+    try:
+        while True:
+            start = time.perf_counter()
+            try:
+                chunk = next(chunks)
+            except StopIteration:
+                elapsed += time.perf_counter() - start
+                break
+            elapsed += time.perf_counter() - start
+            lines += chunk.count("\n")
+            size += len(chunk)
+            yield chunk
+    finally:
+        # Also record generators the consumer stopped early
+        record_span(name, elapsed)
+        if counter_prefix:
+            count(f"{counter_prefix}.lines", lines)
+            count(f"{counter_prefix}.bytes", size)
+
+
+def snapshot() -> dict:
+    """Copy of all spans ({count, total_s, max_s}) and counters."""
+    with _lock:
+        return {
+            "enabled": _enabled,
+            "spans": {name: dict(stats) for name, stats in _spans.items()},
+            "counters": dict(_counters)
+        }
+
+
+def reset():
+    with _lock:
+        _spans.clear()
+        _counters.clear()
+
+
+def to_json(indent: int = 2) -> str:
+    import json
+
+    return json.dumps(snapshot(), indent=indent, sort_keys=True)
+
+
+def _metric_name(name: str) -> str:
+    return f"{PROMETHEUS_PREFIX}_" + "".join(c if c.isalnum() else "_" for c in name)
+
+
+def to_prometheus() -> str:
+    """Metrics in the Prometheus text exposition format."""
+    data = snapshot()
+    lines = []
+    if data["spans"]:
+        for metric, key, kind, help_text in (
+            ("span_seconds_total", "total_s", "counter", "Total time spent in each span."),
+            ("span_calls_total", "count", "counter", "Number of times each span ran."),
+            ("span_max_seconds", "max_s", "gauge", "Longest single run of each span.")
+        ):
+            full = f"{PROMETHEUS_PREFIX}_{metric}"
+            lines += [f"# HELP {full} {help_text}", f"# TYPE {full} {kind}"]
+            for name in sorted(data["spans"]):
+                lines.append(f'{full}{{span="{name}"}} {data["spans"][name][key]}')
+    for name in sorted(data["counters"]):
+        full = _metric_name(name) + "_total"
+        lines += [f"# TYPE {full} counter", f"{full} {data['counters'][name]}"]
+    return "\n".join(lines) + "\n"
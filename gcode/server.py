@@ -0,0 +1,339 @@
+# gcode/server.py
+"""
+Small asyncio HTTP service for programmatic generation:
+``python -m gcode.server --port 8765``.
+
+Endpoints (JSON request bodies):
+
+* ``POST /gcode``: an order with the batch.GCODE_FIELDS keys. The program is
+  streamed with chunked transfer encoding as tray chunks finish rendering,
+  gzip-encoded if the client accepts it.
+* ``POST /pdf``: {"apis": [{"name", "strength"}], "quantity",
+  "unit_weight", "product_name"}; returns the formulation worksheet.
+* ``GET /health``
+
+Planning and rendering run in a bounded process pool, so the event loop
+only moves bytes and can serve many clients at once. Completed responses are
+cached by request content, bounded to CACHE_BYTES.
+"""
+
+import argparse
+import asyncio
+import functools
+import hashlib
+import json
+import os
+import zlib
+from collections import OrderedDict, deque
+from concurrent.futures import ProcessPoolExecutor
+
+from gcode.batch import GCODE_FIELDS, _render_pdf, _render_units, split_traversal
+from gcode.generator import FOOTER, generate_gcode, get_travel_feedrate, iter_unit_blocks, motion_commands, program_header
+
+DEFAULT_PORT = 8765
+MAX_BODY_BYTES = 1 << 20
+# Tray units rendered per worker task
+CHUNK_UNITS = 256
+# Upper bound on cached response bodies; larger bodies are not cached
+CACHE_BYTES = 64 * 1024 * 1024
+MAX_CACHE_ENTRY = CACHE_BYTES // 4
+
+REASONS = {
+    200: "OK", 400: "Bad Request", 404: "Not Found", 405: "Method Not Allowed",
+    413: "Payload Too Large", 500: "Internal Server Error"
+}
+
+_cache = OrderedDict()
+_cache_bytes = 0
+
+
+def _cache_get(key: str):
+    body = _cache.get(key)
+    if body is not None:
+        _cache.move_to_end(key)
+    return body
+
+
+def _cache_put(key: str, body: bytes):
+    global _cache_bytes
+    if len(body) > MAX_CACHE_ENTRY or key in _cache:
+        return
+    _cache[key] = body
+    _cache_bytes += len(body)
+    while _cache_bytes > CACHE_BYTES:
+        _, evicted = _cache.popitem(last=False)
+        _cache_bytes -= len(evicted)
+
+
+def request_key(path: str, spec: dict, encoding: str = "", settings: list = None) -> str:
+    """
+    Identical requests (same path, body and encoding) share a cache key.
+    `settings` adds anything else the response depends on, such as the
+    printer settings in the program header.
+    """
+    canonical = json.dumps([spec, settings], sort_keys=True, separators=(",", ":"))
+    return hashlib.sha256(f"{path}|{encoding}|{canonical}".encode("utf-8")).hexdigest()
+
+
+def plan_gcode(spec: dict) -> tuple:
+    """
+    Split an order into (head, tasks, tail): the program is head, then the
+    results of the (fn, args) tasks in order, then tail. Raises ValueError
+    for an invalid order before anything is rendered.
+    """
+    kwargs = {k: spec[k] for k in GCODE_FIELDS if k in spec}
+    unknown = set(spec) - set(GCODE_FIELDS)
+    if unknown:
+        raise ValueError(f"Unknown fields: {', '.join(sorted(unknown))}.")
+    if "quantity" not in kwargs or "unit_volume_mm3" not in kwargs:
+        raise ValueError("Order needs quantity and unit_volume_mm3.")
+    quantity = kwargs.pop("quantity")
+    unit_volume_mm3 = kwargs.pop("unit_volume_mm3")
+    if not isinstance(quantity, int) or quantity < 1:
+        raise ValueError("quantity must be a positive integer.")
+
+    if kwargs.get("schedule", "unit") != "unit" or kwargs.get("layout") == "subroutine":
+        # Not split by unit range; render the whole program in one task
+        return "", [(functools.partial(generate_gcode, quantity, unit_volume_mm3, **kwargs), ())], ""
+
+    kwargs.pop("schedule", None)
+    # Validate the order up front so errors surface before any output; the
+    # traversal is computed once here and each task gets its slice
+    sequence, slices, worker_kwargs = split_traversal(quantity, kwargs, CHUNK_UNITS)
+    iter_unit_blocks(quantity, unit_volume_mm3, positions=[], **worker_kwargs)
+    head = program_header(
+        quantity, kwargs.get("spacing", 24.0), kwargs.get("traversal", "row-major"), kwargs.get("order"), sequence,
+        travel_feedrate=worker_kwargs["travel_feedrate"]
+    )
+    tasks = [(_render_units, (quantity, unit_volume_mm3, worker_kwargs, positions)) for positions in slices]
+    return head, tasks, "\n".join(FOOTER)
+
+
+def _response_head(status: int, headers: dict) -> bytes:
+    lines = [f"HTTP/1.1 {status} {REASONS[status]}"]
+    lines += [f"{name}: {value}" for name, value in headers.items()]
+    return ("\r\n".join(lines) + "\r\n\r\n").encode("latin-1")
+
+
+async def _send(writer, status: int, body: bytes, content_type: str, extra: dict = None):
+    headers = {"Content-Type": content_type, "Content-Length": len(body), "Connection": "close"}
+    headers.update(extra or {})
+    writer.write(_response_head(status, headers) + body)
+    await writer.drain()
+
+
+async def _send_error(writer, status: int, message: str):
+    body = json.dumps({"error": message}).encode("utf-8")
+    await _send(writer, status, body, "application/json")
+
+
+class Server:
+    """
+    The HTTP service. Rendering runs on a process pool of `workers`; each
+    response keeps at most `workers` render tasks queued ahead of what it
+    has sent, so one large order cannot starve the others.
+    """
+
+    def __init__(self, workers: int = None):
+        self.workers = workers or os.cpu_count() or 1
+        self.pool = ProcessPoolExecutor(max_workers=self.workers)
+        # Start the workers now: workers forked later, while a request is
+        # open, would inherit its socket and keep it open after we close it
+        self.pool.submit(int).result()
+
+    def close(self):
+        self.pool.shutdown(cancel_futures=True)
+
+    async def handle(self, reader, writer):
+        try:
+            request = await self._read_request(reader, writer)
+            if request is not None:
+                await self._dispatch(writer, *request)
+        except (ConnectionError, asyncio.IncompleteReadError):
+            pass
+        except Exception as e:
+            # Raised before any response was started (see _gcode)
+            await _send_error(writer, 500, f"{type(e).__name__}: {e}")
+        finally:
+            writer.close()
+
+    async def _read_request(self, reader, writer):
+        request_line = await reader.readline()
+        try:
+            method, target, _ = request_line.decode("latin-1").split(" ", 2)
+        except ValueError:
+            await _send_error(writer, 400, "Malformed request line.")
+            return None
+
+        headers = {}
+        while True:
+            line = await reader.readline()
+            if line in (b"\r\n", b"\n", b""):
+                break
+            name, _, value = line.decode("latin-1").partition(":")
+            headers[name.strip().lower()] = value.strip()
+
+        try:
+            length = int(headers.get("content-length") or 0)
+        except ValueError:
+            length = -1
+        if length < 0:
+            await _send_error(writer, 400, "Invalid Content-Length.")
+            return None
+        if length > MAX_BODY_BYTES:
+            await _send_error(writer, 413, "Request body too large.")
+            return None
+        body = await reader.readexactly(length) if length else b""
+        return method.upper(), target.split("?", 1)[0], headers, body
+
+    async def _dispatch(self, writer, method: str, path: str, headers: dict, body: bytes):
+        if path == "/health":
+            await _send(writer, 200, b'{"status": "ok"}', "application/json")
+            return
+        if path not in ("/gcode", "/pdf"):
+            await _send_error(writer, 404, "Unknown endpoint.")
+            return
+        if method != "POST":
+            await _send_error(writer, 405, "Use POST.")
+            return
+
+        try:
+            spec = json.loads(body or b"{}")
+            if not isinstance(spec, dict):
+                raise ValueError("Request body must be a JSON object.")
+        except ValueError as e:
+            await _send_error(writer, 400, f"Invalid JSON: {e}")
+            return
+
+        if path == "/pdf":
+            await self._pdf(writer, spec)
+        else:
+            gzip = "gzip" in headers.get("accept-encoding", "")
+            await self._gcode(writer, spec, gzip)
+
+    async def _pdf(self, writer, spec: dict):
+        key = request_key("/pdf", spec)
+        pdf = _cache_get(key)
+        if pdf is None:
+            try:
+                if not spec.get("apis"):
+                    raise ValueError("Request needs a non-empty apis list.")
+                loop = asyncio.get_running_loop()
+                pdf = await loop.run_in_executor(self.pool, _render_pdf, spec)
+            except (ValueError, KeyError, TypeError) as e:
+                await _send_error(writer, 400, f"{type(e).__name__}: {e}")
+                return
+            _cache_put(key, pdf)
+        await _send(writer, 200, pdf, "application/pdf")
+
+    async def _gcode(self, writer, spec: dict, gzip: bool):
+        encoding = "gzip" if gzip else ""
+        extra = {"Content-Encoding": "gzip"} if gzip else {}
+        # Admin edits to the printer settings must not be served stale
+        key = request_key("/gcode", spec, encoding, motion_commands() + [get_travel_feedrate()])
+        cached = _cache_get(key)
+        if cached is not None:
+            await _send(writer, 200, cached, "text/plain; charset=utf-8", extra)
+            return
+
+        loop = asyncio.get_running_loop()
+        try:
+            # Planning computes the traversal (O(N) for nearest) and validates
+            # the order, so it runs on the pool rather than the event loop
+            head, tasks, tail = await loop.run_in_executor(self.pool, plan_gcode, spec)
+        except (ValueError, TypeError) as e:
+            await _send_error(writer, 400, f"{type(e).__name__}: {e}")
+            return
+
+        tasks = iter(tasks)
+        pending = deque()
+
+        def refill():
+            while len(pending) < self.workers:
+                task = next(tasks, None)
+                if task is None:
+                    return
+                fn, args = task
+                pending.append(loop.run_in_executor(self.pool, fn, *args))
+
+        refill()
+        try:
+            # The first piece decides between an error response and a stream
+            first = await pending.popleft()
+        except (ValueError, TypeError) as e:
+            for future in pending:
+                future.cancel()
+            await _send_error(writer, 400, f"{type(e).__name__}: {e}")
+            return
+
+        compressor = zlib.compressobj(6, zlib.DEFLATED, 31) if gzip else None
+        parts = []
+        size = 0
+
+        async def send_chunk(data: bytes):
+            nonlocal size
+            if compressor:
+                data = compressor.compress(data)
+            if not data:
+                return
+            if size <= MAX_CACHE_ENTRY:
+                parts.append(data)
+            size += len(data)
+            writer.write(b"%x\r\n%s\r\n" % (len(data), data))
+            await writer.drain()
+
+        headers = {"Content-Type": "text/plain; charset=utf-8", "Transfer-Encoding": "chunked", "Connection": "close"}
+        headers.update(extra)
+        writer.write(_response_head(200, headers))
+        try:
+            await send_chunk((head + first).encode("utf-8"))
+            while pending:
+                text = await pending.popleft()
+                refill()
+                await send_chunk(text.encode("utf-8"))
+            await send_chunk(tail.encode("utf-8"))
+            if compressor:
+                data = compressor.flush()
+                parts.append(data)
+                size += len(data)
+                writer.write(b"%x\r\n%s\r\n" % (len(data), data))
+            writer.write(b"0\r\n\r\n")
+            await writer.drain()
+        except Exception:
+            # The response has started, so just close the connection; the
+            # unterminated chunked body tells the client it is incomplete
+            return
+        finally:
+            # Client went away or rendering failed mid-stream: drop queued work
+            for future in pending:
+                future.cancel()
+
+        if size <= MAX_CACHE_ENTRY:
+            _cache_put(key, b"".join(parts))
+
+
+async def serve(host: str = "127.0.0.1", port: int = DEFAULT_PORT, workers: int = None):
+    server = Server(workers)
+    try:
+        listener = await asyncio.start_server(server.handle, host, port)
+        async with listener:
+            await listener.serve_forever()
+    finally:
+        server.close()
+
+
+def main(argv: list = None):
+    parser = argparse.ArgumentParser(prog="python -m gcode.server", description="Serve G-code and formulation PDFs over HTTP.")
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=DEFAULT_PORT)
+    parser.add_argument("--workers", type=int, default=None, help="render processes (default: CPU count)")
+    args = parser.parse_args(argv)
+    print(f"Serving on http://{args.host}:{args.port}")
+    try:
+        asyncio.run(serve(args.host, args.port, args.workers))
+    except KeyboardInterrupt:
+        pass
+
+
+if __name__ == "__main__":
+    main()
@@ -1,29 +1,39 @@
 # gcode/shapes.py
 
 import math
+from collections import namedtuple
+from functools import lru_cache
 
-def generate_circle(radius: float = 6.0, segments: int = 16):
-    """Generate (x, y) coordinates for a circle as a closed polygon."""
-    return [
+# Number of distinct (shape, dimensions) paths kept in memory
+SHAPE_CACHE_SIZE = 128
+
+ShapePath = namedtuple("ShapePath", ["points", "segment_lengths", "perimeter"])
+
+
+@lru_cache(maxsize=SHAPE_CACHE_SIZE)
+def _circle_points(radius: float, segments: int) -> tuple:
+    return tuple(
         (
             radius * math.cos(2 * math.pi * i / segments),
             radius * math.sin(2 * math.pi * i / segments)
         )
         for i in range(segments + 1)
-    ]
+    )
 
-def generate_oval(length: float = 12.0, width: float = 6.0, segments: int = 24):
-    """Generate (x, y) coordinates for an oval (ellipse)."""
-    return [
+
+@lru_cache(maxsize=SHAPE_CACHE_SIZE)
+def _oval_points(length: float, width: float, segments: int) -> tuple:
+    return tuple(
         (
             (length / 2) * math.cos(2 * math.pi * i / segments),
             (width / 2) * math.sin(2 * math.pi * i / segments)
         )
         for i in range(segments + 1)
-    ]
+    )
 
-def generate_caplet(length: float = 12.0, width: float = 6.0, resolution: int = 8):
-    """Generate a stadium (caplet) shape made from lines and arcs."""
+
+@lru_cache(maxsize=SHAPE_CACHE_SIZE)
+def _caplet_points(length: float, width: float, resolution: int) -> tuple:
     r = width / 2
     arc_pts = [
         (
@@ -33,4 +43,56 @@ def generate_caplet(length: float = 12.0, width: float = 6.0, resolution: int =
     ]
     arc_front = [(x + (length/2 - r), y) for x, y in arc_pts]
     arc_back = [(x - (length/2 - r), -y) for x, y in reversed(arc_pts)]
-    return arc_front + arc_back + [arc_front[0]]  # close the shape
+    return tuple(arc_front + arc_back + [arc_front[0]])  # close the shape
+
+
+def generate_circle(radius: float = 6.0, segments: int = 16):
+    """Generate (x, y) coordinates for a circle as a closed polygon."""
+    return list(_circle_points(radius, segments))
+
+def generate_oval(length: float = 12.0, width: float = 6.0, segments: int = 24):
+    """Generate (x, y) coordinates for an oval (ellipse)."""
+    return list(_oval_points(length, width, segments))
+
+def generate_caplet(length: float = 12.0, width: float = 6.0, resolution: int = 8):
+    """Generate a stadium (caplet) shape made from lines and arcs."""
+    return list(_caplet_points(length, width, resolution))
+
+
+SHAPES = {
+    "circle": (_circle_points, {"radius": 6.0, "segments": 16}),
+    "oval": (_oval_points, {"length": 12.0, "width": 6.0, "segments": 24}),
+    "caplet": (_caplet_points, {"length": 12.0, "width": 6.0, "resolution": 8}),
+}
+
+
+def path_from_points(points) -> ShapePath:
+    """Build an immutable ShapePath from a sequence of (x, y) points."""
+    points = tuple(points)
+    segment_lengths = tuple(
+        math.dist(points[i], points[i + 1])
+        for i in range(len(points) - 1)
+    )
+    return ShapePath(points, segment_lengths, sum(segment_lengths))
+
+
+@lru_cache(maxsize=SHAPE_CACHE_SIZE)
+def _cached_shape_path(shape: str, dims: tuple) -> ShapePath:
+    builder, defaults = SHAPES[shape]
+    return path_from_points(builder(**dict(defaults, **dict(dims))))
+
+
+def get_shape_path(shape: str, **dims) -> ShapePath:
+    """
+    Return the cached, immutable path for a shape along with its segment
+    lengths and perimeter. Dimensions default to those of generate_<shape>.
+    """
+    if shape not in SHAPES:
+        raise ValueError("Unsupported shape. Add support in shapes.py.")
+    return _cached_shape_path(shape, tuple(sorted(dims.items())))
+
+
+def clear_shape_cache():
+    """Drop all cached shape paths."""
+    for cached in (_circle_points, _oval_points, _caplet_points, _cached_shape_path):
+        cached.cache_clear()
@@ -0,0 +1,335 @@
+# gcode/template.py
+"""
+Line-by-line parser and streaming rewriter for uploaded G-code path
+templates.
+
+Each line is tokenized into a (command, params, comment) record: `command`
+is the first word (e.g. "G1", "T0", or "" for a comment-only line),
+`params` a list of (letter, value) string pairs in their original order and
+`comment` the text after ";" (None if the line has no comment). Commands
+that take free text (M117 and the like) get a single ("", text) param.
+The rewriters re-format the records of XY moves with a new E value and copy
+every other line through stripped. Rewrites work on batches of lines, so a
+template is never held in memory whole.
+
+load_template keeps parsed templates in a bounded cache keyed by content
+hash, so a new dose only re-injects E values (iter_injected).
+"""
+
+import codecs
+import hashlib
+import re
+import sys
+import threading
+from collections import OrderedDict, namedtuple
+from itertools import accumulate, chain, islice, repeat
+
+from gcode.compress import GZIP_MAGIC, MAGIC, READ_SIZE, _Prefixed, iter_gcode_lines
+
+# Lines written before the rewritten template body
+TEMPLATE_HEADER = [
+    "T0 ;must be in tool 0 state",
+    ";Begin print table index:-1  Parameter offset x18  y18",
+    "G21",
+    "G90",
+    "M83",
+    "G1 F900"
+]
+
+TOOL_SWITCH = ["T1 ;switch to second head", "G1 F900"]
+
+MOVE_COMMANDS = ("G1", "G01")
+MOVE_PREFIXES = MOVE_COMMANDS + ("g1", "g01")
+# Commands whose argument is free text (messages, file names), not words
+FREE_TEXT_COMMANDS = ("M23", "M28", "M30", "M32", "M117", "M118", "M928")
+
+# Compressed templates are rewritten this many lines at a time
+BATCH_SIZE = 4096
+
+# Upper bound on the memory held by cached template parses
+TEMPLATE_CACHE_BYTES = 256 * 1024 * 1024
+
+# literals[k] is the text before the E value of XY move k (the last one is
+# the text after the final move); lines/moves count template lines and XY
+# moves, nbytes is the approximate memory held
+ParsedTemplate = namedtuple("ParsedTemplate", ["literals", "lines", "moves", "nbytes"])
+
+_template_cache = OrderedDict()
+_template_cache_bytes = 0
+_template_cache_lock = threading.Lock()
+
+_WORD = re.compile(r"([A-Za-z])\s*([-+]?[0-9]*\.?[0-9]*)")
+# Upper-case words separated by single spaces, the common case, which can
+# be split without running _WORD over the line
+_PLAIN_WORDS = re.compile(r"[A-Z][-+]?[0-9]*\.?[0-9]*(?: [A-Z][-+]?[0-9]*\.?[0-9]*)*")
+
+
+def parse_line(line: str) -> tuple:
+    """Split one G-code line into a (command, params, comment) record."""
+    code, sep, comment = line.partition(";")
+    comment = comment if sep else None
+    code = code.strip()
+    if _PLAIN_WORDS.fullmatch(code):
+        command, *words = code.split(" ")
+        if command not in FREE_TEXT_COMMANDS:
+            return command, [(word[0], word[1:]) for word in words], comment
+    match = _WORD.match(code)
+    if match is None:
+        # Comment-only line, or text that is not a G-code word
+        return "", [("", code)] if code else [], comment
+    command = match.group(1).upper() + match.group(2)
+    rest = code[match.end():]
+    if command in FREE_TEXT_COMMANDS:
+        text = rest.strip()
+        return command, [("", text)] if text else [], comment
+    return command, [(letter.upper(), value) for letter, value in _WORD.findall(rest)], comment
+
+
+def format_line(command: str, params: list, comment: str = None) -> str:
+    """Inverse of parse_line, with single spaces between words."""
+    words = [command] if command else []
+    words += [letter + value for letter, value in params]
+    line = " ".join(words)
+    if comment is None:
+        return line
+    return f"{line} ;{comment}" if line else f";{comment}"
+
+
+def iter_records(lines):
+    """Yield a (command, params, comment) record per line."""
+    for line in lines:
+        yield parse_line(line)
+
+
+def is_xy_move(command: str, params: list) -> bool:
+    """True for a G1 move with an X or Y coordinate."""
+    if command not in MOVE_COMMANDS:
+        return False
+    for letter, _ in params:
+        if letter == "X" or letter == "Y":
+            return True
+    return False
+
+
+def iter_line_batches(source):
+    """
+    Yield lists of lines from a plain, gzip or binary G-code template.
+    `source` is a path or a binary file object; plain text is split a read
+    block at a time, which is much faster than line-by-line iteration.
+    """
+    if isinstance(source, (str, bytes)) or hasattr(source, "__fspath__"):
+        with open(source, "rb") as f:
+            yield from iter_line_batches(f)
+        return
+
+    head = source.read(len(MAGIC))
+    stream = _Prefixed(head, source)
+    if head.startswith(GZIP_MAGIC) or head == MAGIC:
+        lines = iter_gcode_lines(stream)
+        while True:
+            batch = list(islice(lines, BATCH_SIZE))
+            if not batch:
+                return
+            yield batch
+
+    decoder = codecs.getincrementaldecoder("utf-8")()
+    pending = ""
+    while True:
+        data = stream.read(READ_SIZE)
+        batch = (pending + decoder.decode(data, final=not data)).split("\n")
+        pending = batch.pop()
+        if batch:
+            yield batch
+        if not data:
+            break
+    if pending:
+        yield [pending]
+
+
+def _split_move(line: str):
+    """
+    For a stripped XY move line, return (prefix, comment): the move's record
+    formatted without its E word, and its comment (or None). Returns None
+    for other lines.
+    """
+    # Cheap prefix test first; only G1 candidates are tokenized
+    if not line.startswith(MOVE_PREFIXES):
+        return None
+    command, params, comment = parse_line(line)
+    if not is_xy_move(command, params):
+        return None
+    return format_line(command, [word for word in params if word[0] != "E"]), comment
+
+
+def iter_rewritten(batches, e_per_line: float, switch_point: int = None, header: list = TEMPLATE_HEADER, stats: dict = None):
+    """
+    Yield the rewritten template as text chunks that join into the full
+    program: `header`, then the template lines stripped, with every XY
+    move's E value replaced by the running extrusion total. If
+    `switch_point` is set, the tool switch to T1 is inserted before that
+    (0-based) XY move. Comments are kept.
+
+    `batches` is an iterable of line lists, as from iter_line_batches. If
+    given, `stats` is updated with the "lines" read and "moves" rewritten.
+    """
+    extrusion = 0.0
+    moves = 0
+    count = 0
+    yield "\n".join(header)
+    for batch in batches:
+        count += len(batch)
+        out = []
+        for line in batch:
+            line = line.strip()
+            move = _split_move(line)
+            if move is None:
+                out.append(line)
+                continue
+            prefix, comment = move
+            if moves == switch_point:
+                out += TOOL_SWITCH
+            extrusion += e_per_line
+            moves += 1
+            # Same text as format_line with the new E word appended
+            line = f"{prefix} E{round(extrusion, 4)}"
+            out.append(line if comment is None else f"{line} ;{comment}")
+        yield "\n" + "\n".join(out)
+
+    if stats is not None:
+        stats.update(lines=count, moves=moves)
+
+
+def write_template(fileobj, source, e_per_line: float, switch_point: int = None) -> int:
+    """
+    Stream the rewritten template from `source` (a path or binary file
+    object, plain or compressed) into a text file object. Returns the
+    number of XY moves whose E was rewritten.
+    """
+    stats = {}
+    for chunk in iter_rewritten(iter_line_batches(source), e_per_line, switch_point, stats=stats):
+        fileobj.write(chunk)
+    return stats["moves"]
+
+
+def template_digest(source) -> str:
+    """
+    SHA-256 of a template's raw bytes. File objects are read from the start
+    and rewound afterwards.
+    """
+    if isinstance(source, (str, bytes)) or hasattr(source, "__fspath__"):
+        with open(source, "rb") as f:
+            return template_digest(f)
+    digest = hashlib.sha256()
+    source.seek(0)
+    for data in iter(lambda: source.read(READ_SIZE), b""):
+        digest.update(data)
+    source.seek(0)
+    return digest.hexdigest()
+
+
+def parse_template(source) -> ParsedTemplate:
+    """
+    Parse a template into the literal text around its XY moves' E values,
+    so the E values can be re-injected without tokenizing it again.
+    """
+    literals = []
+    pending = []
+    lines = 0
+    for batch in iter_line_batches(source):
+        lines += len(batch)
+        for line in batch:
+            line = line.strip()
+            move = _split_move(line)
+            if move is None:
+                pending.append("\n" + line)
+                continue
+            prefix, comment = move
+            pending.append(f"\n{prefix} E")
+            literals.append("".join(pending))
+            pending = [" ;" + comment] if comment is not None else []
+    literals.append("".join(pending))
+    nbytes = sum(map(sys.getsizeof, literals)) + sys.getsizeof(literals)
+    return ParsedTemplate(literals, lines, len(literals) - 1, nbytes)
+
+
+def load_template(source) -> ParsedTemplate:
+    """
+    Parse a template (a path or seekable binary file object), reusing an
+    earlier parse of identical content. Parses are kept in a process-wide
+    LRU cache bounded to TEMPLATE_CACHE_BYTES.
+    """
+    global _template_cache_bytes
+    key = template_digest(source)
+    with _template_cache_lock:
+        parsed = _template_cache.get(key)
+        if parsed is not None:
+            _template_cache.move_to_end(key)
+            return parsed
+
+    parsed = parse_template(source)
+    if parsed.nbytes > TEMPLATE_CACHE_BYTES:
+        # Too big to cache; the caller still gets the parse
+        return parsed
+
+    with _template_cache_lock:
+        if key not in _template_cache:
+            _template_cache[key] = parsed
+            _template_cache_bytes += parsed.nbytes
+        while _template_cache_bytes > TEMPLATE_CACHE_BYTES:
+            _, evicted = _template_cache.popitem(last=False)
+            _template_cache_bytes -= evicted.nbytes
+    return parsed
+
+
+def template_cache_info() -> dict:
+    with _template_cache_lock:
+        return {
+            "entries": len(_template_cache),
+            "bytes": _template_cache_bytes,
+            "limit": TEMPLATE_CACHE_BYTES
+        }
+
+
+def clear_template_cache():
+    global _template_cache_bytes
+    with _template_cache_lock:
+        _template_cache.clear()
+        _template_cache_bytes = 0
+
+
+def iter_injected(template: ParsedTemplate, e_per_line: float, switch_point: int = None, header: list = TEMPLATE_HEADER):
+    """
+    Yield the same chunks as iter_rewritten from a parsed template. Only the
+    E values are computed, so this is cheap to rerun for a new dose.
+    """
+    literals = template.literals
+    # accumulate adds in the same order as the streaming rewrite, so the
+    # running totals (and the output) are identical
+    totals = accumulate(repeat(e_per_line, template.moves))
+    values = map(str, map(round, totals, repeat(4)))
+
+    yield "\n".join(header)
+    for start in range(0, template.moves, BATCH_SIZE):
+        stop = min(start + BATCH_SIZE, template.moves)
+        pieces = literals[start:stop]
+        if switch_point is not None and start <= switch_point < stop:
+            # The switch goes before the move line that ends this literal
+            head, sep, tail = pieces[switch_point - start].rpartition("\n")
+            pieces[switch_point - start] = head + "\n" + "\n".join(TOOL_SWITCH) + sep + tail
+        yield "".join(chain.from_iterable(zip(pieces, islice(values, stop - start))))
+    yield literals[-1]
+
+
+def render_template(template: ParsedTemplate, e_per_line: float, switch_point: int = None) -> str:
+    """Rewritten program text for a parsed template."""
+    return "".join(iter_injected(template, e_per_line, switch_point))
+
+
+def preview_template(template: ParsedTemplate, e_per_line: float, switch_point: int = None, lines: int = 25) -> str:
+    """The first `lines` lines of the rewritten program, without rendering the rest."""
+    text = ""
+    for chunk in iter_injected(template, e_per_line, switch_point):
+        text += chunk
+        if text.count("\n") >= lines:
+            break
+    return "\n".join(text.split("\n", lines)[:lines])
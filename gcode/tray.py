@@ -1,5 +1,11 @@
 # gcode/tray.py
 import math
+import threading
+from functools import lru_cache
+
+# Nearest-neighbour tours kept for reuse (header, tray blocks, UI plan)
+TOUR_CACHE_SIZE = 8
+_tour_lock = threading.Lock()
 
 def get_xy_offset(index: int, spacing: float = 24.0, columns: int = None) -> tuple:
     """
@@ -12,8 +18,123 @@ def get_xy_offset(index: int, spacing: float = 24.0, columns: int = None) -> tup
     col = index % columns
     return (col * spacing, row * spacing)
 
+def get_columns(quantity: int) -> int:
+    """
+    Returns the column count of a `quantity`-unit print grid (near square).
+    """
+    return int(math.ceil(math.sqrt(quantity))) or 1
+
+def get_tray_extent(quantity: int, spacing: float = 24.0) -> tuple:
+    """
+    Returns the X and Y size of the print grid for `quantity` units, one
+    `spacing` cell per unit, with the generator's column count.
+    """
+    columns = get_columns(quantity)
+    rows = math.ceil(quantity / columns)
+    return (columns * spacing, rows * spacing)
+
 def get_comment(index: int, offset_x: float, offset_y: float) -> str:
     """
     Returns a Craft-style comment for unit identification.
     """
     return f";Begin print table index:{index+1}  Parameter offset x{offset_x}  y{offset_y}"
+
+TRAVERSALS = ["row-major", "serpentine", "nearest", "custom"]
+
+@lru_cache(maxsize=TOUR_CACHE_SIZE)
+def _nearest_neighbour(quantity: int, columns: int) -> tuple:
+    """Greedy nearest-unvisited tour over the grid, starting at index 0."""
+    rows = math.ceil(quantity / columns)
+    visited = [False] * quantity
+    visited[0] = True
+    order = [0]
+    r = c = 0
+    for _ in range(quantity - 1):
+        best = None
+        limit = max(rows, columns)
+        k = 1
+        # Search square rings of growing radius; once a candidate is found at
+        # ring k, anything closer can be at most k*sqrt(2) rings out
+        while k <= limit:
+            for rr in range(r - k, r + k + 1):
+                if rr < 0 or rr >= rows:
+                    continue
+                step = 1 if rr in (r - k, r + k) else 2 * k
+                for cc in range(c - k, c + k + 1, step):
+                    idx = rr * columns + cc
+                    if 0 <= cc < columns and idx < quantity and not visited[idx]:
+                        cand = ((rr - r) ** 2 + (cc - c) ** 2, idx)
+                        if best is None or cand < best:
+                            best = cand
+            if best is not None:
+                limit = min(limit, math.ceil(k * math.sqrt(2)))
+            k += 1
+        idx = best[1]
+        visited[idx] = True
+        order.append(idx)
+        r, c = divmod(idx, columns)
+    return tuple(order)
+
+def get_traversal_order(quantity: int, columns: int, strategy: str = "row-major", order: list = None) -> list:
+    """
+    Returns the sequence of grid indices to print. Strategies are "row-major",
+    "serpentine" (alternate row direction), "nearest" (greedy nearest
+    neighbour) and "custom" (a user-supplied permutation in `order`).
+    """
+    if strategy == "row-major":
+        return list(range(quantity))
+    if strategy == "serpentine":
+        seq = []
+        for row_start in range(0, quantity, columns):
+            row = list(range(row_start, min(row_start + columns, quantity)))
+            seq += row[::-1] if (row_start // columns) % 2 else row
+        return seq
+    if strategy == "nearest":
+        if not quantity:
+            return []
+        # The tour is O(n) per unit placed; concurrent callers wait for one
+        # computation and share the cached result
+        with _tour_lock:
+            return list(_nearest_neighbour(quantity, columns))
+    if strategy == "custom":
+        if order is None or sorted(order) != list(range(quantity)):
+            raise ValueError("Custom traversal order must list every tray index exactly once.")
+        return list(order)
+    raise ValueError(f"Unsupported traversal. Choose one of: {', '.join(TRAVERSALS)}.")
+
+def get_travel_distance(sequence: list, spacing: float = 24.0, columns: int = 1) -> float:
+    """
+    Returns the total XY travel (mm) between consecutive units of a sequence.
+    """
+    total = 0.0
+    for a, b in zip(sequence, sequence[1:]):
+        total += math.dist(get_xy_offset(a, spacing, columns), get_xy_offset(b, spacing, columns))
+    return total
+
+def plan_traversal(
+    quantity: int,
+    spacing: float = 24.0,
+    strategy: str = "serpentine",
+    order: list = None,
+    travel_feedrate: float = 3000.0,
+    sequence: list = None
+) -> dict:
+    """
+    Returns the print order for a strategy with its travel distance and the
+    distance and time (at `travel_feedrate` mm/min) saved against row-major.
+    Pass `sequence` if the caller already computed the order.
+    """
+    columns = get_columns(quantity)
+    if sequence is None:
+        sequence = get_traversal_order(quantity, columns, strategy, order)
+    travel_mm = get_travel_distance(sequence, spacing, columns)
+    baseline_mm = get_travel_distance(list(range(quantity)), spacing, columns)
+    saved_mm = baseline_mm - travel_mm
+    return {
+        "strategy": strategy,
+        "order": sequence,
+        "travel_mm": travel_mm,
+        "baseline_travel_mm": baseline_mm,
+        "saved_mm": saved_mm,
+        "saved_s": saved_mm / (travel_feedrate / 60)
+    }
@@ -1,5 +1,4 @@
 import streamlit as st
-import pandas as pd
 from gcode.generator import generate_gcode
 from utils.pdf_export import generate_pdf
 from utils.logs import log_session
@@ -38,10 +37,12 @@ else:
 
         submitted = st.form_submit_button("Generate G-code and PDF")
 
-    total_mg = api1 + api2 + api3 + api4
-    max_api_percent = 0.25  # Adjustable if needed
-    unit_weight = total_mg / max_api_percent if max_api_percent > 0 else 0
-    unit_volume_mm3 = (unit_weight / 1200) * 1000  # 1200 mg/mL density
+    from utils.formulation import DEFAULT_API_LIMIT, formulate
+
+    formulation = formulate([[api1, api2, api3, api4]], DEFAULT_API_LIMIT)
+    total_mg = float(formulation["api_total_mg"][0])
+    unit_weight = float(formulation["unit_weight_mg"][0])
+    unit_volume_mm3 = float(formulation["unit_volume_mm3"][0])  # 1200 mg/mL density
 
     st.markdown(f"**Estimated unit weight:** {unit_weight:.1f} mg")
     st.markdown(f"**Target volume per unit:** {unit_volume_mm3:.1f} mm³")
@@ -57,6 +58,8 @@ else:
         st.download_button("⬇️ Download G-code", gcode, file_name="crafthealth_output.gcode")
 
         # PDF formulation
+        import pandas as pd
+
         df = pd.DataFrame([
             {"name": "API 1", "ingredient_type": "API", "percentage": (api1/unit_weight)*100 if unit_weight else 0, "total_mg": api1 * quantity},
             {"name": "API 2", "ingredient_type": "API", "percentage": (api2/unit_weight)*100 if unit_weight else 0, "total_mg": api2 * quantity},
@@ -3,6 +3,8 @@ import streamlit as st
 import pandas as pd
 import math
 
+from utils.formulation import formulate_order
+
 st.set_page_config(page_title="NCC G-code Generator", layout="wide")
 ADMIN_PASSWORD = "nccadmin"
 
@@ -50,11 +52,17 @@ if page == "Formulation Builder":
             apis.append({"name": name, "strength": strength})
 
     if st.button("Generate G-code"):
-        api_df = pd.DataFrame(apis)
-        total_api_mg = api_df["strength"].sum()
-        max_percent = st.session_state.api_limits[product_type]
-        required_unit_weight = total_api_mg / max_percent
-        unit_volume = (required_unit_weight / 1200) * 1000  # mm³ at 1200 mg/mL
+        try:
+            formulation = formulate_order(
+                {"product_type": product_type, "apis": apis, "quantity": quantity},
+                st.session_state.api_limits,
+                st.session_state.base_templates
+            )
+        except ValueError as e:
+            st.error(f"Calculation error: {e}")
+            st.stop()
+        required_unit_weight = formulation["unit_weight_mg"]
+        unit_volume = formulation["unit_volume_mm3"]
 
         # Geometry setup
         layer_height = 0.3
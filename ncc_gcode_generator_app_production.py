@@ -3,11 +3,12 @@
 # Includes full multi-layer tablet logic, volume-based extrusion, dual-head support, and Craft Health formatting
 
 import streamlit as st
-import pandas as pd
 from datetime import datetime
 from fpdf import FPDF
 import math
 
+from utils.formulation import formulate, order_errors
+
 st.set_page_config(page_title="NCC G-code Generator", layout="wide")
 
 st.title("💊 NCC G-code Generator – Production Ready")
@@ -50,14 +51,19 @@ if page == "Formulation Builder":
             apis_selected.append({"name": name, "strength": strength})
 
     if st.button("Generate G-code"):
-        api_df = pd.DataFrame(apis_selected)
-        total_api_mg = api_df["strength"].sum()
-        max_percent = product_types[product_type]
-        required_unit_weight = total_api_mg / max_percent
-        total_batch_weight = required_unit_weight * quantity
+        result = formulate(
+            [[api["strength"] for api in apis_selected]], product_types[product_type], quantity,
+            density=density_mg_per_ml
+        )
+        errors = order_errors(result)
+        if errors:
+            st.error(f"Calculation error: {errors[0]}")
+            st.stop()
+        required_unit_weight = float(result["unit_weight_mg"][0])
+        total_batch_weight = float(result["batch_weight_mg"][0])
 
         # Volume per unit in mm³
-        unit_volume_mm3 = (required_unit_weight / density_mg_per_ml) * 1000
+        unit_volume_mm3 = float(result["unit_volume_mm3"][0])
 
         # Geometry
         diameter = 12.0
@@ -129,18 +135,11 @@ if page == "Formulation Builder":
                         g_line += f" D{d_val:.3f}"
                     gcode.append(g_line)
                 gcode.append("G1 E-1 D-1 F1800")
-                gcode.append("G92 E0
-G92 D0")
+                gcode.append("G92 E0\nG92 D0")
             gcode.append("G1 Z5 F3000")
 
-        gcode.append("M104 S0
-M140 S0
-M84")
+        gcode.append("M104 S0\nM140 S0\nM84")
 
         gcode_file = "final_output.gcode"
-        with open(f"/mnt/data/{gcode_file}", "w") as f:
-            f.write("\n".join(gcode))
-
-        with open(f"/mnt/data/{gcode_file}", "rb") as f:
-            st.download_button("⬇️ Download G-code", f, file_name=gcode_file)
+        st.download_button("⬇️ Download G-code", "\n".join(gcode), file_name=gcode_file)
 
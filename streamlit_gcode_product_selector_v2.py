@@ -2,72 +2,11 @@
 import streamlit as st
 import math
 
-# --- Expanded Product Type + API + Base Mapping ---
-formulations = {
-    "Bupropion": {
-        "product_type": "Biphasic Tablet",
-        "T0": {
-            "base": "R4Ha",
-            "density": 1.10,
-            "dry_loading": 80,
-            "line_width_mm": 0.96,
-            "layer_height_mm": 0.475
-        },
-        "T1": {
-            "base": "R15M",
-            "density": 1.12,
-            "dry_loading": 80,
-            "line_width_mm": 0.96,
-            "layer_height_mm": 0.475
-        },
-        "shape": "Cylinder",
-        "diameter_cm": 1.2,
-        "height_cm": 0.421,
-        "default_dose_mg": 240
-    },
-    "Melatonin": {
-        "product_type": "Rapid Dissolve Tablet (RDT)",
-        "T0": {
-            "base": "PEG6000/Mannitol",
-            "density": 0.95,
-            "dry_loading": 10,
-            "line_width_mm": 0.8,
-            "layer_height_mm": 0.4
-        },
-        "shape": "Caplet",
-        "diameter_cm": 0.8,
-        "height_cm": 0.3,
-        "default_dose_mg": 3
-    },
-    "Progesterone": {
-        "product_type": "Lozenge",
-        "T0": {
-            "base": "Isomalt-Glycerin",
-            "density": 1.20,
-            "dry_loading": 15,
-            "line_width_mm": 1.0,
-            "layer_height_mm": 0.4
-        },
-        "shape": "Cylinder",
-        "diameter_cm": 1.4,
-        "height_cm": 0.5,
-        "default_dose_mg": 100
-    },
-    "Naltrexone": {
-        "product_type": "Sublingual Fast-Melt",
-        "T0": {
-            "base": "Xylitol-MCC-CCS",
-            "density": 0.85,
-            "dry_loading": 7,
-            "line_width_mm": 0.75,
-            "layer_height_mm": 0.35
-        },
-        "shape": "Disc",
-        "diameter_cm": 1.0,
-        "height_cm": 0.25,
-        "default_dose_mg": 4.5
-    }
-}
+from gcode.template import load_template, preview_template, render_template
+from utils.registry import get_section
+
+# --- Product Type + API + Base Mapping (Config/formulations.json) ---
+formulations = get_section("formulations")
 
 product_types = sorted(set([v["product_type"] for v in formulations.values()]))
 
@@ -115,38 +54,14 @@ e_per_line = round(total_extrusion_mm3 / total_lines, 4)
 uploaded_file = st.file_uploader("Upload G-code Path Template", type=["gcode", "txt"])
 
 if uploaded_file:
-    gcode_lines = uploaded_file.read().decode("utf-8").splitlines()
-    modified_lines = []
-
-    modified_lines.append("T0 ;must be in tool 0 state")
-    modified_lines.append(";Begin print table index:-1  Parameter offset x18  y18")
-    modified_lines.append("G21")
-    modified_lines.append("G90")
-    modified_lines.append("M83")
-    modified_lines.append("G1 F900")
-
-    extrusion = 0.0
-    switch_point = total_lines // 2 if dual_head else total_lines + 1
-    injected = 0
-    tool_head = "T0"
-
-    for i, line in enumerate(gcode_lines):
-        stripped = line.strip()
-        if stripped.startswith("G1") and ("X" in stripped or "Y" in stripped):
-            if dual_head and injected == switch_point:
-                tool_head = "T1"
-                modified_lines.append("T1 ;switch to second head")
-                modified_lines.append("G1 F900")
-
-            extrusion += e_per_line
-            if "E" in stripped:
-                stripped = stripped.split("E")[0].strip()
-            modified_lines.append(f"{stripped} E{round(extrusion, 4)}")
-            injected += 1
-        else:
-            modified_lines.append(stripped)
-
-    st.success(f"{injected} extrusion lines updated.")
-    st.download_button("📥 Download G-code", data="\n".join(modified_lines), file_name="generated_gcode_v2.gcode")
+    # Parses are cached by content hash, so a rerun for a new dose or
+    # formulation only re-injects the E values
+    template = load_template(uploaded_file)
+    switch_point = total_lines // 2 if dual_head else None
+
+    st.success(f"{template.moves} extrusion lines updated.")
+    st.caption(f"Template: {template.lines} lines, {template.moves} XY moves (formulation expects {total_lines}).")
+    # The full program is only rendered when the download is clicked
+    st.download_button("📥 Download G-code", data=lambda: render_template(template, e_per_line, switch_point), file_name="generated_gcode_v2.gcode")
     st.subheader("🔍 Preview")
-    st.code("\n".join(modified_lines[:25]), language="gcode")
+    st.code(preview_template(template, e_per_line, switch_point), language="gcode")
@@ -1,43 +1,115 @@
 # utils/admin_ui.py
 import streamlit as st
-import pandas as pd
+from gcode import metrics
+from utils.logs import SESSION_LOG, api_rollup, daily_rollup, rebuild_analytics, shape_rollup
+from utils.registry import CONFIG_DIR, get_section, reload_registry, save_section, thaw
 
 def render_admin_panel():
+    import pandas as pd
+
     st.title("🛠 Admin Panel")
     pw = st.text_input("Enter admin password", type="password")
 
     if pw == "nccadmin":
         st.success("Access granted")
 
+        # Edits are saved to Config/ and reach every session on its next run
+        products = thaw(get_section("products"))
+        catalogs = thaw(get_section("catalogs"))
+
         st.subheader("📊 API % Limits")
-        for ptype in st.session_state.api_limits:
-            val = st.number_input(
+        limits = {
+            ptype: st.number_input(
                 f"{ptype} Max %",
                 min_value=0.01, max_value=1.0,
-                value=st.session_state.api_limits[ptype],
+                value=float(limit),
                 key=f"limit_{ptype}"
             )
-            st.session_state.api_limits[ptype] = val
+            for ptype, limit in products["api_limits"].items()
+        }
+        if st.button("Save API Limits") and limits != products["api_limits"]:
+            products["api_limits"] = limits
+            save_section("products", products)
+            st.success("Limits updated.")
 
         st.subheader("🧪 Base Template Editor")
-        ptype = st.selectbox("Product Type", list(st.session_state.base_templates.keys()), key="edit_ptype")
-        df = pd.DataFrame(st.session_state.base_templates[ptype])
+        ptype = st.selectbox("Product Type", list(products["base_templates"].keys()), key="edit_ptype")
+        df = pd.DataFrame(products["base_templates"][ptype])
         edited = st.data_editor(df, num_rows="dynamic", use_container_width=True)
         if st.button("Save Base Formula"):
-            st.session_state.base_templates[ptype] = edited.to_dict(orient="records")
+            products["base_templates"][ptype] = edited.to_dict(orient="records")
+            save_section("products", products)
             st.success("Base updated.")
 
         st.subheader("🧬 Add APIs & Flavours")
         new_api = st.text_input("New API")
         if st.button("Add API") and new_api:
-            if new_api not in st.session_state.available_apis:
-                st.session_state.available_apis.append(new_api)
+            if new_api not in catalogs["apis"]:
+                catalogs["apis"].append(new_api)
+                save_section("catalogs", catalogs)
                 st.success(f"Added: {new_api}")
 
         new_flav = st.text_input("New Flavour")
         if st.button("Add Flavour") and new_flav:
-            if new_flav not in st.session_state.available_flavours:
-                st.session_state.available_flavours.append(new_flav)
+            if new_flav not in catalogs["flavours"]:
+                catalogs["flavours"].append(new_flav)
+                save_section("catalogs", catalogs)
                 st.success(f"Added: {new_flav}")
+
+        st.subheader("🖨 Printer")
+        printer = thaw(get_section("printer"))
+        col1, col2, col3 = st.columns(3)
+        bed_x = col1.number_input("Bed X (mm)", min_value=1.0, value=float(printer["bed"]["x_mm"]))
+        bed_y = col2.number_input("Bed Y (mm)", min_value=1.0, value=float(printer["bed"]["y_mm"]))
+        travel = col3.number_input(
+            "Travel feedrate (mm/min)", min_value=1.0, value=float(printer["motion"]["travel_feedrate_mm_min"])
+        )
+        if st.button("Save Printer Settings"):
+            printer["bed"].update(x_mm=bed_x, y_mm=bed_y)
+            printer["motion"]["travel_feedrate_mm_min"] = travel
+            save_section("printer", printer)
+            st.success("Printer settings updated.")
+        if st.button("Reload Config"):
+            reload_registry()
+            st.success(f"Reloaded from {CONFIG_DIR}.")
+
+        st.subheader("📈 Generation History")
+        # Read from the pre-aggregated rollups, not the full log
+        daily = daily_rollup(SESSION_LOG)
+        if daily:
+            st.bar_chart(pd.DataFrame(daily).set_index("day")["units"])
+            st.dataframe(pd.DataFrame(shape_rollup(SESSION_LOG)), use_container_width=True)
+            by_api = api_rollup(SESSION_LOG)
+            if by_api:
+                st.dataframe(pd.DataFrame(by_api), use_container_width=True)
+        else:
+            st.caption("No generation history recorded yet.")
+        if st.button("Rebuild History from CSV"):
+            st.success(f"Added {rebuild_analytics(SESSION_LOG)} missing log rows.")
+
+        st.subheader("⏱ Performance Metrics")
+        enabled = st.checkbox("Collect timing spans and counters", value=metrics.is_enabled())
+        metrics.enable(enabled)
+        data = metrics.snapshot()
+        if data["spans"]:
+            st.dataframe(pd.DataFrame([
+                {
+                    "span": name,
+                    "calls": stats["count"],
+                    "total (s)": stats["total_s"],
+                    "mean (ms)": stats["total_s"] / stats["count"] * 1000,
+                    "max (ms)": stats["max_s"] * 1000
+                }
+                for name, stats in sorted(data["spans"].items())
+            ]), use_container_width=True)
+            st.dataframe(pd.DataFrame(sorted(data["counters"].items()), columns=["counter", "value"]), use_container_width=True)
+        else:
+            st.caption("No metrics recorded yet.")
+        col1, col2, col3 = st.columns(3)
+        col1.download_button("Download JSON", metrics.to_json(), file_name="metrics.json")
+        col2.download_button("Download Prometheus", metrics.to_prometheus(), file_name="metrics.prom")
+        if col3.button("Reset Metrics"):
+            metrics.reset()
+            st.rerun()
     else:
         st.warning("Enter valid admin password.")
@@ -1,24 +1,49 @@
 # utils/builder_ui.py
+import time
+import uuid
 import streamlit as st
-import pandas as pd
 from gcode.generator import generate_gcode
+from gcode.compress import generate_gcode_gzip
+from gcode.tray import get_tray_extent, plan_traversal
 from utils.pdf_export import generate_pdf
-from utils.logs import log_session
+from utils.logs import SESSION_LOG, log_session
+from utils.jobs import forget_job, get_job, submit_job
+
+# How often the page re-checks a running background job
+JOB_POLL_SECONDS = 0.5
 
 def render_formulation_builder():
     st.title("💊 NCC G-code Generator")
 
     product_type = st.selectbox("Product Type", list(st.session_state.base_templates.keys()))
     shape = st.selectbox("Shape", ["circle", "oval", "caplet"])
+    infill = st.selectbox("Infill", ["none", "concentric"])
+    use_arcs = st.checkbox("Fit arcs (G2/G3) to round paths")
     flavour = st.selectbox("Flavour", st.session_state.available_flavours)
     quantity = st.number_input("Quantity", min_value=1, value=30)
     head_mode = st.radio("Print Head Mode", ["Single Head", "Dual Head"])
+    traversal = st.selectbox("Tray Order", ["row-major", "serpentine", "nearest"])
+    schedule = st.radio(
+        "Print Schedule", ["unit", "layer"],
+        format_func=lambda s: "Unit by unit" if s == "unit" else "Layer by layer (whole tray)"
+    )
+    # Relative/subroutine layouts repeat one unit stack, so they need the unit schedule
+    layout = st.selectbox("G-code Layout", ["expanded", "relative", "subroutine"]) if schedule == "unit" else "expanded"
+    compress = st.checkbox("Compress G-code download (.gcode.gz)")
+
+    bed = st.session_state.printer["bed"]
+    tray_x, tray_y = get_tray_extent(quantity)
+    if tray_x > bed["x_mm"] or tray_y > bed["y_mm"]:
+        st.warning(
+            f"A {quantity}-unit tray needs {tray_x:.0f} × {tray_y:.0f} mm, "
+            f"larger than the {bed['x_mm']:.0f} × {bed['y_mm']:.0f} mm bed."
+        )
 
     st.subheader("Active Ingredients")
     apis = []
     for i in range(4):
         col1, col2 = st.columns(2)
-        options = [""] + st.session_state.available_apis
+        options = [""] + list(st.session_state.available_apis)
         default_value = options[0] if i >= len(options) or options[0] not in options else options[0]
         name = col1.selectbox(
             f"API #{i+1}",
@@ -38,64 +63,142 @@ def render_formulation_builder():
             return
 
         try:
-            api_df = pd.DataFrame(apis)
-            total_api_mg = api_df["strength"].sum()
-            max_percent = st.session_state.api_limits.get(product_type, 0.25)
-            required_unit_weight = total_api_mg / max_percent if max_percent > 0 else 0
-            unit_volume_mm3 = (required_unit_weight / 1200) * 1000 if required_unit_weight > 0 else 0
-
-            if required_unit_weight <= 0 or unit_volume_mm3 <= 0:
-                st.error("Calculation error: check API values and product type settings.")
-                return
-
-            gcode = generate_gcode(
-                quantity=quantity,
-                unit_volume_mm3=unit_volume_mm3,
-                shape=shape,
-                head_mode=head_mode
-            )
-            st.download_button("⬇️ Download G-code", gcode, file_name="crafthealth_output.gcode")
+            # numpy is only loaded once something is formulated
+            from utils.formulation import formulate_order
 
-            # Build PDF DataFrame
-            api_df["total_mg"] = api_df["strength"] * quantity
-            api_df["percentage"] = api_df["strength"] / required_unit_weight * 100 if required_unit_weight else 0
-            api_df["ingredient_type"] = "API"
-
-            pdf_bytes = generate_pdf(api_df, product_name=f"CraftHealth {product_type}", quantity=quantity, unit_weight=required_unit_weight)
-            st.download_button("📄 Download Formulation PDF", pdf_bytes, file_name="formulation.pdf")
+            try:
+                formulation = formulate_order(
+                    {"product_type": product_type, "apis": apis, "quantity": quantity},
+                    st.session_state.api_limits,
+                    st.session_state.base_templates
+                )
+            except ValueError as e:
+                st.error(f"Calculation error: {e}")
+                return
+            unit_weight = formulation["unit_weight_mg"]
 
-            # Log session
-            log_session("logs.csv", {
+            gcode_kwargs = {
+                "quantity": quantity,
+                "unit_volume_mm3": formulation["unit_volume_mm3"],
+                "shape": shape,
+                "head_mode": head_mode,
+                "traversal": traversal,
+                "schedule": schedule,
+                "infill": infill,
+                "arc_tolerance": 0.01 if use_arcs else None,
+                "layout": layout,
+                "travel_feedrate": st.session_state.printer["motion"]["travel_feedrate_mm_min"]
+            }
+            log_entry = {
                 "shape": shape,
                 "quantity": quantity,
                 "head_mode": head_mode,
-                "api_total_mg": total_api_mg,
-                "unit_weight_mg": required_unit_weight
-            })
+                "api_total_mg": formulation["api_total_mg"],
+                "unit_weight_mg": unit_weight,
+                "apis": apis
+            }
+
+            # The stages are independent, so they run concurrently in the
+            # background; a repeated click in this session joins the job
+            # already running
+            if "job_owner" not in st.session_state:
+                st.session_state.job_owner = uuid.uuid4().hex
+            if "builder_job" in st.session_state:
+                forget_job(st.session_state.builder_job)
+            st.session_state.builder_job = submit_job({
+                "gcode": (generate_gcode_gzip if compress else generate_gcode, (), gcode_kwargs),
+                "pdf": (generate_pdf, (formulation["rows"], f"CraftHealth {product_type}", quantity, unit_weight), {}),
+                "plan": (plan_traversal, (quantity,), {
+                    "strategy": traversal,
+                    "travel_feedrate": st.session_state.printer["motion"]["travel_feedrate_mm_min"]
+                }),
+                "log": (log_session, (SESSION_LOG, log_entry), {})
+            }, owner=st.session_state.job_owner)
+            st.session_state.builder_job_file = "crafthealth_output.gcode.gz" if compress else "crafthealth_output.gcode"
 
         except Exception as e:
             st.error(f"Something went wrong: {e}")
+
+    _render_job_results()
+
+
+def _render_job_results():
+    """Show progress of the background job, or its results once finished."""
+    job_id = st.session_state.get("builder_job")
+    if job_id is None:
+        return
+    job = get_job(job_id)
+    if job is None:
+        # Results were dropped from the job store
+        del st.session_state.builder_job
+        return
+
+    stages = job["stages"]
+    if job["status"] == "running":
+        done = sum(stage["status"] != "running" for stage in stages.values())
+        st.progress(job["progress"], text=f"Generating... {done}/{len(stages)} steps done")
+        time.sleep(JOB_POLL_SECONDS)
+        st.rerun()
+
+    for name, stage in stages.items():
+        if stage["error"]:
+            st.error(f"Something went wrong ({name}): {stage['error']}")
+
+    if stages["gcode"]["result"] is not None:
+        st.download_button("⬇️ Download G-code", stages["gcode"]["result"], file_name=st.session_state.builder_job_file)
+
+    plan = stages["plan"]["result"]
+    if plan and plan["saved_mm"] > 0:
+        st.caption(f"Tray order saves {plan['saved_mm']:.0f} mm of travel (~{plan['saved_s']:.0f} s) vs. row-major.")
+
+    if stages["pdf"]["result"] is not None:
+        st.download_button("📄 Download Formulation PDF", stages["pdf"]["result"], file_name="formulation.pdf")
 # utils/builder_ui.py
+import time
+import uuid
 import streamlit as st
-import pandas as pd
 from gcode.generator import generate_gcode
+from gcode.compress import generate_gcode_gzip
+from gcode.tray import get_tray_extent, plan_traversal
 from utils.pdf_export import generate_pdf
-from utils.logs import log_session
+from utils.logs import SESSION_LOG, log_session
+from utils.jobs import forget_job, get_job, submit_job
+
+# How often the page re-checks a running background job
+JOB_POLL_SECONDS = 0.5
 
 def render_formulation_builder():
     st.title("💊 NCC G-code Generator")
 
     product_type = st.selectbox("Product Type", list(st.session_state.base_templates.keys()))
     shape = st.selectbox("Shape", ["circle", "oval", "caplet"])
+    infill = st.selectbox("Infill", ["none", "concentric"])
+    use_arcs = st.checkbox("Fit arcs (G2/G3) to round paths")
     flavour = st.selectbox("Flavour", st.session_state.available_flavours)
     quantity = st.number_input("Quantity", min_value=1, value=30)
     head_mode = st.radio("Print Head Mode", ["Single Head", "Dual Head"])
+    traversal = st.selectbox("Tray Order", ["row-major", "serpentine", "nearest"])
+    schedule = st.radio(
+        "Print Schedule", ["unit", "layer"],
+        format_func=lambda s: "Unit by unit" if s == "unit" else "Layer by layer (whole tray)"
+    )
+    # Relative/subroutine layouts repeat one unit stack, so they need the unit schedule
+    layout = st.selectbox("G-code Layout", ["expanded", "relative", "subroutine"]) if schedule == "unit" else "expanded"
+    compress = st.checkbox("Compress G-code download (.gcode.gz)")
+
+    bed = st.session_state.printer["bed"]
+    tray_x, tray_y = get_tray_extent(quantity)
+    if tray_x > bed["x_mm"] or tray_y > bed["y_mm"]:
+        st.warning(
+            f"A {quantity}-unit tray needs {tray_x:.0f} × {tray_y:.0f} mm, "
+            f"larger than the {bed['x_mm']:.0f} × {bed['y_mm']:.0f} mm bed."
+        )
 
     st.subheader("Active Ingredients")
     apis = []
     for i in range(4):
         col1, col2 = st.columns(2)
-        name = col1.selectbox(f"API #{i+1}", [""] + st.session_state.available_apis, key=f"api_name_{i}")
+        name = col1.selectbox(f"API #{i+1}", [""] + list(st.session_state.available_apis), key=f"api_name_{i}")
         strength = col2.number_input(f"Strength (mg/unit)", min_value=0.0, step=0.1, key=f"api_strength_{i}")
         if name and strength > 0:
             apis.append({"name": name, "strength": strength})
@@ -106,40 +209,93 @@ def render_formulation_builder():
             return
 
         try:
-            api_df = pd.DataFrame(apis)
-            total_api_mg = api_df["strength"].sum()
-            max_percent = st.session_state.api_limits.get(product_type, 0.25)
-            required_unit_weight = total_api_mg / max_percent if max_percent > 0 else 0
-            unit_volume_mm3 = (required_unit_weight / 1200) * 1000 if required_unit_weight > 0 else 0
-
-            if required_unit_weight <= 0 or unit_volume_mm3 <= 0:
-                st.error("Calculation error: check API values and product type settings.")
-                return
-
-            gcode = generate_gcode(
-                quantity=quantity,
-                unit_volume_mm3=unit_volume_mm3,
-                shape=shape,
-                head_mode=head_mode
-            )
-            st.download_button("⬇️ Download G-code", gcode, file_name="crafthealth_output.gcode")
+            # numpy is only loaded once something is formulated
+            from utils.formulation import formulate_order
 
-            # Build PDF DataFrame
-            api_df["total_mg"] = api_df["strength"] * quantity
-            api_df["percentage"] = api_df["strength"] / required_unit_weight * 100 if required_unit_weight else 0
-            api_df["ingredient_type"] = "API"
-
-            pdf_bytes = generate_pdf(api_df, product_name=f"CraftHealth {product_type}", quantity=quantity, unit_weight=required_unit_weight)
-            st.download_button("📄 Download Formulation PDF", pdf_bytes, file_name="formulation.pdf")
+            try:
+                formulation = formulate_order(
+                    {"product_type": product_type, "apis": apis, "quantity": quantity},
+                    st.session_state.api_limits,
+                    st.session_state.base_templates
+                )
+            except ValueError as e:
+                st.error(f"Calculation error: {e}")
+                return
+            unit_weight = formulation["unit_weight_mg"]
 
-            # Log session
-            log_session("logs.csv", {
+            gcode_kwargs = {
+                "quantity": quantity,
+                "unit_volume_mm3": formulation["unit_volume_mm3"],
+                "shape": shape,
+                "head_mode": head_mode,
+                "traversal": traversal,
+                "schedule": schedule,
+                "infill": infill,
+                "arc_tolerance": 0.01 if use_arcs else None,
+                "layout": layout,
+                "travel_feedrate": st.session_state.printer["motion"]["travel_feedrate_mm_min"]
+            }
+            log_entry = {
                 "shape": shape,
                 "quantity": quantity,
                 "head_mode": head_mode,
-                "api_total_mg": total_api_mg,
-                "unit_weight_mg": required_unit_weight
-            })
+                "api_total_mg": formulation["api_total_mg"],
+                "unit_weight_mg": unit_weight,
+                "apis": apis
+            }
+
+            # The stages are independent, so they run concurrently in the
+            # background; a repeated click in this session joins the job
+            # already running
+            if "job_owner" not in st.session_state:
+                st.session_state.job_owner = uuid.uuid4().hex
+            if "builder_job" in st.session_state:
+                forget_job(st.session_state.builder_job)
+            st.session_state.builder_job = submit_job({
+                "gcode": (generate_gcode_gzip if compress else generate_gcode, (), gcode_kwargs),
+                "pdf": (generate_pdf, (formulation["rows"], f"CraftHealth {product_type}", quantity, unit_weight), {}),
+                "plan": (plan_traversal, (quantity,), {
+                    "strategy": traversal,
+                    "travel_feedrate": st.session_state.printer["motion"]["travel_feedrate_mm_min"]
+                }),
+                "log": (log_session, (SESSION_LOG, log_entry), {})
+            }, owner=st.session_state.job_owner)
+            st.session_state.builder_job_file = "crafthealth_output.gcode.gz" if compress else "crafthealth_output.gcode"
 
         except Exception as e:
             st.error(f"Something went wrong: {e}")
+
+    _render_job_results()
+
+
+def _render_job_results():
+    """Show progress of the background job, or its results once finished."""
+    job_id = st.session_state.get("builder_job")
+    if job_id is None:
+        return
+    job = get_job(job_id)
+    if job is None:
+        # Results were dropped from the job store
+        del st.session_state.builder_job
+        return
+
+    stages = job["stages"]
+    if job["status"] == "running":
+        done = sum(stage["status"] != "running" for stage in stages.values())
+        st.progress(job["progress"], text=f"Generating... {done}/{len(stages)} steps done")
+        time.sleep(JOB_POLL_SECONDS)
+        st.rerun()
+
+    for name, stage in stages.items():
+        if stage["error"]:
+            st.error(f"Something went wrong ({name}): {stage['error']}")
+
+    if stages["gcode"]["result"] is not None:
+        st.download_button("⬇️ Download G-code", stages["gcode"]["result"], file_name=st.session_state.builder_job_file)
+
+    plan = stages["plan"]["result"]
+    if plan and plan["saved_mm"] > 0:
+        st.caption(f"Tray order saves {plan['saved_mm']:.0f} mm of travel (~{plan['saved_s']:.0f} s) vs. row-major.")
+
+    if stages["pdf"]["result"] is not None:
+        st.download_button("📄 Download Formulation PDF", stages["pdf"]["result"], file_name="formulation.pdf")
@@ -0,0 +1,186 @@
+# utils/formulation.py
+"""
+Vectorized formulation engine: API strengths -> unit weight -> print volume,
+for many orders in one pass of numpy array arithmetic.
+
+Per order (all masses per unit):
+
+    api_total_mg    = sum of API strengths
+    unit_weight_mg  = api_total_mg / api_limit      (unless the order fixes it)
+    api percentage  = strength / unit_weight_mg * 100
+    excipient mg    = (unit_weight_mg - api_total_mg) * base share
+    unit_volume_mm3 = unit_weight_mg / DENSITY_MG_PER_ML * 1000
+
+where api_limit is the product type's cap from `api_limits` (the largest
+fraction of the unit the APIs may make up) and the base shares are the
+product type's `base_templates` percentages, normalised to sum to 1.
+Invalid orders are flagged in the result rather than raised, so feasibility
+checks over thousands of prospective orders need no Python loop per order.
+"""
+
+import numpy as np
+
+DENSITY_MG_PER_ML = 1200
+DEFAULT_API_LIMIT = 0.25
+
+ERROR_MESSAGES = {
+    "no_api": "No API strength entered.",
+    "negative_api": "API strengths cannot be negative.",
+    "bad_limit": "API limit must be above 0 and at most 1.",
+    "bad_weight": "Unit weight must be positive.",
+    "over_limit": "APIs exceed the API limit for this unit weight."
+}
+
+
+def formulate(api_mg, api_limit, quantity=1, unit_weight_mg=None, density: float = DENSITY_MG_PER_ML) -> dict:
+    """
+    Core pass over arrays. `api_mg` is (orders, APIs) mg per unit, zero
+    padded, or (orders,) totals; `api_limit`, `quantity` and `unit_weight_mg`
+    are per order or scalars (NaN unit weights are derived from the limit).
+
+    Returns a dict of arrays: api_mg (2-D), api_total_mg, unit_weight_mg,
+    unit_volume_mm3, api_percentage (same shape as api_mg), api_share
+    (fraction of the unit), batch_api_mg, batch_weight_mg, a boolean mask
+    per ERROR_MESSAGES key and `valid`.
+    """
+    api_mg = np.asarray(api_mg, dtype=float)
+    if api_mg.ndim == 1:
+        api_mg = api_mg[:, None]
+    n = api_mg.shape[0]
+    api_limit = np.broadcast_to(np.asarray(api_limit, dtype=float), (n,))
+    quantity = np.broadcast_to(np.asarray(quantity, dtype=float), (n,))
+
+    api_total = api_mg.sum(axis=1)
+    bad_limit = ~((api_limit > 0) & (api_limit <= 1))
+    with np.errstate(divide="ignore", invalid="ignore"):
+        derived = np.where(bad_limit, np.nan, api_total / np.where(bad_limit, 1, api_limit))
+        if unit_weight_mg is None:
+            unit_weight = derived
+        else:
+            given = np.broadcast_to(np.asarray(unit_weight_mg, dtype=float), (n,))
+            unit_weight = np.where(np.isnan(given), derived, given)
+        positive = unit_weight > 0
+        api_share = np.where(positive, api_total / np.where(positive, unit_weight, 1), np.nan)
+        api_percentage = np.where(positive[:, None], api_mg / np.where(positive, unit_weight, 1)[:, None] * 100, np.nan)
+
+    result = {
+        "api_mg": api_mg,
+        "api_total_mg": api_total,
+        "unit_weight_mg": unit_weight,
+        "unit_volume_mm3": unit_weight / density * 1000,
+        "api_percentage": api_percentage,
+        "api_share": api_share,
+        "batch_api_mg": api_total * quantity,
+        "batch_weight_mg": unit_weight * quantity,
+        "no_api": api_total <= 0,
+        "negative_api": (api_mg < 0).any(axis=1),
+        "bad_limit": bad_limit,
+        "bad_weight": ~positive & ~bad_limit,
+        # Tolerance for limits that divide exactly, e.g. 5 mg / 0.2
+        "over_limit": positive & (api_share > api_limit * (1 + 1e-9))
+    }
+    result["valid"] = ~np.logical_or.reduce([result[key] for key in ERROR_MESSAGES])
+    return result
+
+
+def _pad(rows: list, width: int) -> np.ndarray:
+    out = np.zeros((len(rows), width))
+    for i, row in enumerate(rows):
+        out[i, :len(row)] = row
+    return out
+
+
+def formulate_orders(orders: list, api_limits: dict, base_templates: dict, density: float = DENSITY_MG_PER_ML) -> dict:
+    """
+    Formulate order dicts with "product_type", "apis" ([{"name",
+    "strength"}]), optional "quantity" (default 1) and optional
+    "unit_weight" (mg; derived from the product type's API limit if
+    missing).
+
+    Returns formulate()'s arrays plus excipient_mg and batch_excipient_mg
+    (orders, excipients; zero padded), type_index into product_types, and
+    the inputs needed by worksheet_rows().
+    """
+    product_types = list(base_templates)
+    type_ids = {ptype: i for i, ptype in enumerate(product_types)}
+    try:
+        type_index = np.array([type_ids[order["product_type"]] for order in orders], dtype=int)
+    except KeyError as e:
+        raise ValueError(f"Unsupported product type {e}. Use one of: {', '.join(product_types)}.") from None
+
+    apis = [order.get("apis") or [] for order in orders]
+    api_mg = _pad([[api["strength"] for api in row] for row in apis], max([len(row) for row in apis], default=0))
+    limits = np.array([api_limits.get(ptype, DEFAULT_API_LIMIT) for ptype in product_types], dtype=float)
+    quantity = np.array([order.get("quantity", 1) for order in orders], dtype=float)
+    unit_weight = np.array([order.get("unit_weight") or np.nan for order in orders], dtype=float)
+
+    result = formulate(api_mg, limits[type_index], quantity, unit_weight, density)
+
+    # One row of base shares per product type, gathered per order
+    percentages = [[item["percentage"] for item in base_templates[ptype]] for ptype in product_types]
+    shares = _pad(percentages, max([len(row) for row in percentages], default=0))
+    totals = shares.sum(axis=1, keepdims=True)
+    shares = np.divide(shares, totals, out=np.zeros_like(shares), where=totals > 0)
+    base_mg = np.clip(result["unit_weight_mg"] - result["api_total_mg"], 0, None)
+    result["excipient_mg"] = np.nan_to_num(base_mg)[:, None] * shares[type_index]
+    result["batch_excipient_mg"] = result["excipient_mg"] * quantity[:, None]
+
+    result["type_index"] = type_index
+    result["product_types"] = product_types
+    result["excipient_names"] = [[item["name"] for item in base_templates[ptype]] for ptype in product_types]
+    result["api_names"] = [[api["name"] for api in row] for row in apis]
+    result["quantity"] = quantity
+    return result
+
+
+def order_errors(result: dict) -> dict:
+    """{order index: message} for every invalid order in a result."""
+    errors = {}
+    for key, message in ERROR_MESSAGES.items():
+        for i in np.flatnonzero(result[key]):
+            errors.setdefault(int(i), message)
+    return errors
+
+
+def worksheet_rows(result: dict, i: int) -> list:
+    """Records for the formulation worksheet (utils.pdf_export) of order `i`."""
+    unit_weight = float(result["unit_weight_mg"][i])
+    quantity = float(result["quantity"][i])
+    rows = [
+        {
+            "name": name,
+            "ingredient_type": "API",
+            "percentage": float(result["api_percentage"][i, j]),
+            "total_mg": float(result["api_mg"][i, j]) * quantity
+        }
+        for j, name in enumerate(result["api_names"][i])
+    ]
+    names = result["excipient_names"][result["type_index"][i]]
+    rows += [
+        {
+            "name": name,
+            "ingredient_type": "Excipient",
+            "percentage": float(result["excipient_mg"][i, j]) / unit_weight * 100,
+            "total_mg": float(result["batch_excipient_mg"][i, j])
+        }
+        for j, name in enumerate(names)
+    ]
+    return rows
+
+
+def formulate_order(order: dict, api_limits: dict, base_templates: dict) -> dict:
+    """
+    Formulate a single order; raises ValueError if it is invalid. Returns
+    api_total_mg, unit_weight_mg and unit_volume_mm3 as floats and the
+    worksheet rows.
+    """
+    result = formulate_orders([order], api_limits, base_templates)
+    errors = order_errors(result)
+    if errors:
+        raise ValueError(errors[0])
+    return {
+        "api_total_mg": float(result["api_total_mg"][0]),
+        "unit_weight_mg": float(result["unit_weight_mg"][0]),
+        "unit_volume_mm3": float(result["unit_volume_mm3"][0]),
+        "rows": worksheet_rows(result, 0)
+    }
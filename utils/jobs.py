@@ -0,0 +1,146 @@
+# utils/jobs.py
+"""
+Process-wide background job runner for the Streamlit pages.
+
+A job is a dict of independent named stages, each a (fn, args, kwargs)
+call. Stages run concurrently on a shared worker pool, so the script thread
+returns immediately and picks the results up on a later rerun via get_job.
+Submitting a job identical to one the same owner (e.g. a browser session)
+still has in flight returns that job's id instead of starting a duplicate.
+Jobs are never shared between owners, so each owner's stages (such as a
+session log row) run once per owner and forget_job only drops its own job.
+"""
+
+import hashlib
+import itertools
+import threading
+from concurrent.futures import ThreadPoolExecutor
+
+JOB_WORKERS = 4
+# Finished jobs kept for pickup, by count and by the total size of their
+# str/bytes results (G-code can run to hundreds of MB); older ones are
+# dropped first, but the newest is always kept
+MAX_FINISHED_JOBS = 32
+MAX_FINISHED_BYTES = 256 * 1024 * 1024
+
+_executor = None
+_jobs = {}
+_in_flight = {}
+_finished = []
+_finished_bytes = 0
+_ids = itertools.count(1)
+_lock = threading.Lock()
+
+
+def _get_executor() -> ThreadPoolExecutor:
+    global _executor
+    if _executor is None:
+        _executor = ThreadPoolExecutor(max_workers=JOB_WORKERS, thread_name_prefix="job")
+    return _executor
+
+
+def job_key(stages: dict, owner: str = None) -> str:
+    """Hash of the owner and stage calls, used to spot identical submissions."""
+    parts = [owner]
+    for name in sorted(stages):
+        fn, args, kwargs = stages[name]
+        parts.append((name, fn.__module__, fn.__qualname__, args, sorted(kwargs.items())))
+    return hashlib.sha256(repr(parts).encode("utf-8")).hexdigest()
+
+
+def _result_size(result) -> int:
+    return len(result) if isinstance(result, (str, bytes)) else 0
+
+
+def _drop_finished(job_id: str):
+    """Remove a finished job from the store; call with _lock held."""
+    global _finished_bytes
+    job = _jobs.pop(job_id, None)
+    if job is not None:
+        _finished_bytes -= job["size"]
+    _finished.remove(job_id)
+
+
+def _finish(job_id: str, job: dict):
+    """Record a job as finished and evict old ones over budget; call with _lock held."""
+    global _finished_bytes
+    job["size"] = sum(_result_size(stage["result"]) for stage in job["stages"].values())
+    _finished.append(job_id)
+    _finished_bytes += job["size"]
+    while len(_finished) > 1 and (len(_finished) > MAX_FINISHED_JOBS or _finished_bytes > MAX_FINISHED_BYTES):
+        _drop_finished(_finished[0])
+
+
+def _run_stage(job_id: str, name: str, fn, args: tuple, kwargs: dict):
+    try:
+        result, error = fn(*args, **kwargs), None
+    except Exception as e:
+        result, error = None, f"{type(e).__name__}: {e}"
+
+    with _lock:
+        job = _jobs.get(job_id)
+        if job is None:
+            return
+        job["stages"][name].update(status="failed" if error else "done", result=result, error=error)
+        job["completed"] += 1
+        if job["completed"] == len(job["stages"]):
+            failed = any(stage["error"] for stage in job["stages"].values())
+            job["status"] = "failed" if failed else "done"
+            _in_flight.pop(job["key"], None)
+            _finish(job_id, job)
+
+
+def submit_job(stages: dict, owner: str = None) -> str:
+    """
+    Start a job of named stages, each a (fn, args, kwargs) tuple, and return
+    its id. An identical job the same `owner` submitted that is still
+    running is reused.
+    """
+    if not stages:
+        raise ValueError("A job needs at least one stage.")
+    key = job_key(stages, owner)
+    with _lock:
+        if key in _in_flight:
+            return _in_flight[key]
+        job_id = f"job-{next(_ids)}"
+        _jobs[job_id] = {
+            "id": job_id,
+            "key": key,
+            "status": "running",
+            "completed": 0,
+            "stages": {
+                name: {"status": "running", "result": None, "error": None}
+                for name in stages
+            }
+        }
+        _in_flight[key] = job_id
+
+    executor = _get_executor()
+    for name, (fn, args, kwargs) in stages.items():
+        executor.submit(_run_stage, job_id, name, fn, args, kwargs)
+    return job_id
+
+
+def get_job(job_id: str) -> dict:
+    """
+    Snapshot of a job: status ("running", "done" or "failed"), progress
+    (0.0 to 1.0) and per-stage status/result/error. None if unknown.
+    """
+    with _lock:
+        job = _jobs.get(job_id)
+        if job is None:
+            return None
+        return {
+            "id": job_id,
+            "status": job["status"],
+            "progress": job["completed"] / len(job["stages"]) if job["stages"] else 1.0,
+            "stages": {name: dict(stage) for name, stage in job["stages"].items()}
+        }
+
+
+def forget_job(job_id: str):
+    """Drop a finished job's results once they have been shown."""
+    with _lock:
+        job = _jobs.get(job_id)
+        if job is not None and job["status"] != "running":
+            _drop_finished(job_id)
@@ -1,19 +1,305 @@
 # utils/logs.py
+import atexit
 import csv
+import os
+import queue
+import sqlite3
+import threading
 from datetime import datetime
+from gcode import metrics
 
-def log_session(output_path: str, entry: dict):
+# Default session log used by the Streamlit pages
+SESSION_LOG = "logs.csv"
+LOG_FIELDS = ["timestamp", "shape", "quantity", "head_mode", "api_total_mg", "unit_weight_mg"]
+
+# Most rows written per file open
+MAX_BATCH = 500
+# Rotate logs.csv to logs.csv.1 (and so on) once it reaches this size
+MAX_LOG_BYTES = 5 * 1024 * 1024
+BACKUP_COUNT = 5
+
+ANALYTICS_SCHEMA = """
+CREATE TABLE IF NOT EXISTS sessions (
+    id INTEGER PRIMARY KEY,
+    timestamp TEXT NOT NULL,
+    day TEXT NOT NULL,
+    shape TEXT,
+    quantity INTEGER,
+    head_mode TEXT,
+    api_total_mg REAL,
+    unit_weight_mg REAL
+);
+CREATE INDEX IF NOT EXISTS sessions_day ON sessions (day);
+CREATE INDEX IF NOT EXISTS sessions_shape_day ON sessions (shape, day);
+CREATE INDEX IF NOT EXISTS sessions_timestamp ON sessions (timestamp);
+CREATE TABLE IF NOT EXISTS daily_shape (
+    day TEXT NOT NULL,
+    shape TEXT NOT NULL,
+    sessions INTEGER NOT NULL,
+    units INTEGER NOT NULL,
+    api_mg REAL NOT NULL,
+    PRIMARY KEY (day, shape)
+);
+CREATE TABLE IF NOT EXISTS daily_api (
+    day TEXT NOT NULL,
+    api TEXT NOT NULL,
+    units INTEGER NOT NULL,
+    api_mg REAL NOT NULL,
+    PRIMARY KEY (day, api)
+);
+"""
+
+_writers = {}
+_writers_lock = threading.Lock()
+
+
+def analytics_path(output_path: str) -> str:
+    """The SQLite store kept next to a log CSV (logs.csv -> logs.db)."""
+    return os.path.splitext(output_path)[0] + ".db"
+
+
+def _connect(db_path: str) -> sqlite3.Connection:
+    conn = sqlite3.connect(db_path)
+    conn.execute("PRAGMA journal_mode=WAL")
+    conn.executescript(ANALYTICS_SCHEMA)
+    return conn
+
+
+def _number(value, cast=float):
+    try:
+        return cast(float(value))
+    except (TypeError, ValueError):
+        return 0
+
+
+def _session_values(row: dict) -> tuple:
+    """The sessions table columns (timestamp onwards) for one log row."""
+    return (
+        row["timestamp"], str(row["timestamp"])[:10], row.get("shape") or None,
+        _number(row.get("quantity"), int), row.get("head_mode") or None,
+        _number(row.get("api_total_mg")), _number(row.get("unit_weight_mg"))
+    )
+
+
+def _store_rows(conn: sqlite3.Connection, rows: list):
+    """
+    Insert rows into the sessions table and fold them into the daily
+    rollups in one transaction. Rows may carry an "apis" list of
+    {"name", "strength"} (mg per unit) for the per-API rollup.
+    """
+    sessions, shapes, apis = [], {}, {}
+    for row in rows:
+        values = _session_values(row)
+        _, day, _, quantity, _, api_total_mg, _ = values
+        api_mg = api_total_mg * quantity
+        sessions.append(values)
+        totals = shapes.setdefault((day, row.get("shape") or ""), [0, 0, 0.0])
+        totals[0] += 1
+        totals[1] += quantity
+        totals[2] += api_mg
+        for api in row.get("apis") or []:
+            totals = apis.setdefault((day, api["name"]), [0, 0.0])
+            totals[0] += quantity
+            totals[1] += _number(api.get("strength")) * quantity
+
+    with conn:
+        conn.executemany(
+            "INSERT INTO sessions (timestamp, day, shape, quantity, head_mode, api_total_mg, unit_weight_mg)"
+            " VALUES (?, ?, ?, ?, ?, ?, ?)", sessions
+        )
+        conn.executemany(
+            "INSERT INTO daily_shape VALUES (?, ?, ?, ?, ?) ON CONFLICT (day, shape) DO UPDATE SET"
+            " sessions = sessions + excluded.sessions, units = units + excluded.units,"
+            " api_mg = api_mg + excluded.api_mg",
+            [key + tuple(totals) for key, totals in shapes.items()]
+        )
+        conn.executemany(
+            "INSERT INTO daily_api VALUES (?, ?, ?, ?) ON CONFLICT (day, api) DO UPDATE SET"
+            " units = units + excluded.units, api_mg = api_mg + excluded.api_mg",
+            [key + tuple(totals) for key, totals in apis.items()]
+        )
+
+
+class LogWriter:
     """
-    Appends a new entry to the session log CSV.
+    The single writer for one log file. Rows from any thread are queued and
+    a background thread appends them in batches, so rows never interleave
+    and the header is written once per file.
     """
-    fieldnames = ["timestamp", "shape", "quantity", "head_mode", "api_total_mg", "unit_weight_mg"]
-    entry["timestamp"] = datetime.now().isoformat(timespec='seconds')
 
+    def __init__(self, path: str, max_bytes: int = None, backup_count: int = None):
+        self.path = path
+        self.max_bytes = MAX_LOG_BYTES if max_bytes is None else max_bytes
+        self.backup_count = BACKUP_COUNT if backup_count is None else backup_count
+        self.db_path = analytics_path(path)
+        self.conn = None
+        self.queue = queue.Queue()
+        self.thread = threading.Thread(target=self._run, name=f"log-writer:{path}", daemon=True)
+        self.thread.start()
+
+    def put(self, row: dict):
+        self.queue.put(row)
+
+    def flush(self):
+        """Block until every queued row has been written."""
+        self.queue.join()
+
+    def _rotate(self):
+        if self.backup_count <= 0:
+            os.remove(self.path)
+            return
+        for i in range(self.backup_count - 1, 0, -1):
+            older = f"{self.path}.{i}"
+            if os.path.exists(older):
+                os.replace(older, f"{self.path}.{i + 1}")
+        os.replace(self.path, f"{self.path}.1")
+
+    def _write(self, rows: list):
+        with metrics.span("log.write"):
+            if self.max_bytes and os.path.exists(self.path) and os.path.getsize(self.path) >= self.max_bytes:
+                self._rotate()
+            with open(self.path, "a", newline="") as csvfile:
+                writer = csv.DictWriter(csvfile, fieldnames=LOG_FIELDS, extrasaction="ignore")
+                if csvfile.tell() == 0:
+                    writer.writeheader()
+                writer.writerows(rows)
+        with metrics.span("log.analytics"):
+            if self.conn is None:
+                # Opened in the writer thread, which is its only user
+                self.conn = _connect(self.db_path)
+            _store_rows(self.conn, rows)
+        metrics.count("log.rows", len(rows))
+        metrics.count("log.batches")
+
+    def _run(self):
+        while True:
+            rows = [self.queue.get()]
+            try:
+                # Rows queued while the last batch was written go out together
+                while len(rows) < MAX_BATCH:
+                    try:
+                        rows.append(self.queue.get_nowait())
+                    except queue.Empty:
+                        break
+                self._write(rows)
+            except Exception as e:
+                print(f"Logging error: {e}")
+            finally:
+                for _ in rows:
+                    self.queue.task_done()
+
+
+def get_writer(output_path: str) -> LogWriter:
+    """The process-wide writer for a log path (created on first use)."""
+    key = os.path.abspath(output_path)
+    with _writers_lock:
+        writer = _writers.get(key)
+        if writer is None:
+            writer = _writers[key] = LogWriter(output_path)
+        return writer
+
+
+def flush_logs():
+    """Wait until all queued log rows have been written."""
+    with _writers_lock:
+        writers = list(_writers.values())
+    for writer in writers:
+        writer.flush()
+
+
+atexit.register(flush_logs)
+
+
+def log_session(output_path: str, entry: dict):
+    """
+    Appends a new entry to the session log CSV. The row is queued and
+    written in the background; call flush_logs() to wait for it.
+    """
+    row = dict(entry, timestamp=datetime.now().isoformat(timespec='seconds'))
     try:
-        with open(output_path, "a", newline="") as csvfile:
-            writer = csv.DictWriter(csvfile, fieldnames=fieldnames)
-            if csvfile.tell() == 0:
-                writer.writeheader()
-            writer.writerow(entry)
+        get_writer(output_path).put(row)
     except Exception as e:
         print(f"Logging error: {e}")
+
+
+def _missing_rows(conn: sqlite3.Connection, rows: list) -> list:
+    """The log rows not yet in the sessions table (identical rows count separately)."""
+    stored = {}
+    missing = []
+    for row in rows:
+        values = _session_values(row)
+        timestamp = values[0]
+        if timestamp not in stored:
+            stored[timestamp] = [
+                tuple(found) for found in conn.execute(
+                    "SELECT timestamp, day, shape, quantity, head_mode, api_total_mg, unit_weight_mg"
+                    " FROM sessions WHERE timestamp = ?", (timestamp,)
+                )
+            ]
+        if values in stored[timestamp]:
+            stored[timestamp].remove(values)
+        else:
+            missing.append(row)
+    return missing
+
+
+def rebuild_analytics(output_path: str) -> int:
+    """
+    Add log CSV rows (and rows in its rotated backups) that are missing from
+    the analytics store, e.g. history logged before the store existed.
+    Returns the number of rows added. Nothing is deleted: history older than
+    the surviving CSVs is kept, and per-API totals, which the CSV does not
+    record, are left as they are.
+    """
+    flush_logs()
+    paths = [f"{output_path}.{i}" for i in range(BACKUP_COUNT, 0, -1)] + [output_path]
+    conn = _connect(analytics_path(output_path))
+    try:
+        imported = 0
+        for path in paths:
+            if not os.path.exists(path):
+                continue
+            with open(path, newline="") as csvfile:
+                rows = [row for row in csv.DictReader(csvfile) if row.get("timestamp")]
+            rows = _missing_rows(conn, rows)
+            _store_rows(conn, rows)
+            imported += len(rows)
+    finally:
+        conn.close()
+    return imported
+
+
+def _query(output_path: str, sql: str, params: tuple) -> list:
+    db_path = analytics_path(output_path)
+    if not os.path.exists(db_path):
+        return []
+    conn = sqlite3.connect(db_path)
+    conn.row_factory = sqlite3.Row
+    try:
+        return [dict(row) for row in conn.execute(sql, params)]
+    finally:
+        conn.close()
+
+
+def daily_rollup(output_path: str, since: str = "0000-00-00", until: str = "9999-99-99") -> list:
+    """Sessions, units and API mg per day (days as YYYY-MM-DD, inclusive)."""
+    return _query(output_path, (
+        "SELECT day, SUM(sessions) AS sessions, SUM(units) AS units, SUM(api_mg) AS api_mg"
+        " FROM daily_shape WHERE day BETWEEN ? AND ? GROUP BY day ORDER BY day"
+    ), (since, until))
+
+
+def shape_rollup(output_path: str, since: str = "0000-00-00", until: str = "9999-99-99") -> list:
+    """Sessions, units and API mg per shape over a day range."""
+    return _query(output_path, (
+        "SELECT shape, SUM(sessions) AS sessions, SUM(units) AS units, SUM(api_mg) AS api_mg"
+        " FROM daily_shape WHERE day BETWEEN ? AND ? GROUP BY shape ORDER BY units DESC"
+    ), (since, until))
+
+
+def api_rollup(output_path: str, since: str = "0000-00-00", until: str = "9999-99-99") -> list:
+    """Units and total mg dispensed per API per Monday-based week (YYYY-WW)."""
+    return _query(output_path, (
+        "SELECT strftime('%Y-%W', day) AS week, api, SUM(units) AS units, SUM(api_mg) AS api_mg"
+        " FROM daily_api WHERE day BETWEEN ? AND ? GROUP BY week, api ORDER BY week, api"
+    ), (since, until))
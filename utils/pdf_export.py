@@ -1,19 +1,43 @@
 # utils/pdf_export.py
 
-from fpdf import FPDF
-import pandas as pd
+import math
+import os
+import threading
+from collections import OrderedDict
 from datetime import datetime
+from functools import lru_cache
+
+from gcode import metrics
+
+PDF_CACHE_SIZE = 256
+# Batches with fewer uncached orders than this are rendered in-process
+PARALLEL_MIN_ORDERS = 16
+
+# Rendered worksheets by (order key, date), least recently used first
+_pdf_cache = OrderedDict()
+_pdf_cache_lock = threading.Lock()
+
+
+@lru_cache(maxsize=None)
+def worksheet_class():
+    """
+    The formulation worksheet layout (one page per order). fpdf is imported
+    and the class defined on first use only, then reused.
+    """
+    from fpdf import FPDF
+
+    class WorksheetPDF(FPDF):
+        title_line = ""
+        detail_line = ""
 
-def generate_pdf(formula_df: pd.DataFrame, product_name: str, quantity: int, unit_weight: float) -> bytes:
-    class PDF(FPDF):
         def header(self):
             self.set_font("Arial", "B", 14)
-            self.cell(0, 10, f"{product_name} - Formulation Worksheet", ln=True, align="C")
+            self.cell(0, 10, self.title_line, ln=True, align="C")
             self.set_font("Arial", "", 10)
-            self.cell(0, 10, f"Date: {datetime.today().strftime('%d %b %Y')} | Qty: {quantity} | Unit Size: {unit_weight:.1f} mg", ln=True, align="C")
+            self.cell(0, 10, self.detail_line, ln=True, align="C")
             self.ln(10)
 
-        def table(self, df):
+        def table(self, rows: tuple):
             self.set_font("Arial", "B", 10)
             self.cell(60, 10, "Ingredient", 1)
             self.cell(30, 10, "Type", 1)
@@ -21,14 +45,132 @@ def generate_pdf(formula_df: pd.DataFrame, product_name: str, quantity: int, uni
             self.cell(40, 10, "Total (mg)", 1)
             self.ln()
             self.set_font("Arial", "", 10)
-            for _, row in df.iterrows():
-                self.cell(60, 10, row["name"], 1)
-                self.cell(30, 10, row["ingredient_type"], 1)
-                self.cell(30, 10, f"{row['percentage']:.2f}", 1)
-                self.cell(40, 10, f"{row['total_mg']:.1f}", 1)
+            for name, ingredient_type, percentage, total_mg in rows:
+                self.cell(60, 10, name, 1)
+                self.cell(30, 10, ingredient_type, 1)
+                self.cell(30, 10, f"{percentage:.2f}", 1)
+                self.cell(40, 10, f"{total_mg:.1f}", 1)
                 self.ln()
 
-    pdf = PDF()
-    pdf.add_page()
-    pdf.table(formula_df)
-    return pdf.output(dest='S').encode('latin1')
+        def worksheet(self, product_name: str, quantity: int, unit_weight: float, rows: tuple, date: str):
+            self.title_line = f"{product_name} - Formulation Worksheet"
+            self.detail_line = f"Date: {date} | Qty: {quantity} | Unit Size: {unit_weight:.1f} mg"
+            self.add_page()
+            self.table(rows)
+
+    return WorksheetPDF
+
+
+def _rows(formula) -> tuple:
+    """Worksheet rows from a DataFrame or a list of record dicts."""
+    records = formula.to_dict("records") if hasattr(formula, "to_dict") else formula
+    return tuple(
+        (str(r["name"]), str(r["ingredient_type"]), float(r["percentage"]), float(r["total_mg"]))
+        for r in records
+    )
+
+
+def _today() -> str:
+    return datetime.today().strftime('%d %b %Y')
+
+
+def _order_key(order: dict) -> tuple:
+    """Hashable (product_name, quantity, unit_weight, rows) for one order."""
+    return (order["product_name"], order["quantity"], float(order["unit_weight"]), _rows(order["formula"]))
+
+
+def _render(orders: tuple, date: str) -> bytes:
+    with metrics.span("pdf.render"):
+        pdf = worksheet_class()()
+        for product_name, quantity, unit_weight, rows in orders:
+            pdf.worksheet(product_name, quantity, unit_weight, rows, date)
+        data = pdf.output(dest='S').encode('latin1')
+    metrics.count("pdf.documents")
+    metrics.count("pdf.bytes", len(data))
+    return data
+
+
+def _cache_get(order: tuple, date: str) -> bytes:
+    # The date is part of the key because it is printed on the worksheet
+    with _pdf_cache_lock:
+        data = _pdf_cache.get((order, date))
+        if data is not None:
+            _pdf_cache.move_to_end((order, date))
+        return data
+
+
+def _cache_put(order: tuple, date: str, data: bytes):
+    with _pdf_cache_lock:
+        _pdf_cache[(order, date)] = data
+        _pdf_cache.move_to_end((order, date))
+        while len(_pdf_cache) > PDF_CACHE_SIZE:
+            _pdf_cache.popitem(last=False)
+
+
+def _render_cached(order: tuple, date: str) -> bytes:
+    data = _cache_get(order, date)
+    if data is None:
+        data = _render((order,), date)
+        _cache_put(order, date, data)
+    return data
+
+
+def _render_chunk(orders: list, date: str) -> list:
+    """Render orders one document each; runs in a worker process."""
+    return [_render((order,), date) for order in orders]
+
+
+def generate_pdf(formula_df, product_name: str, quantity: int, unit_weight: float) -> bytes:
+    """Worksheet for one order; `formula_df` is a DataFrame or a list of records."""
+    order = {"formula": formula_df, "product_name": product_name, "quantity": quantity, "unit_weight": unit_weight}
+    return _render_cached(_order_key(order), _today())
+
+
+def generate_pdfs(orders: list, combined: bool = False, max_workers: int = None):
+    """
+    Render worksheets for many orders, each a dict with "formula" (DataFrame
+    or records), "product_name", "quantity" and "unit_weight". Returns one
+    PDF per order, or a single multi-page document if `combined`.
+
+    Orders already in the worksheet cache are not rendered again; the rest
+    are rendered once per distinct order (across worker processes for large
+    batches) and added to the cache.
+    """
+    keys = [_order_key(order) for order in orders]
+    date = _today()
+    if combined:
+        return _render(tuple(keys), date)
+
+    pdfs = [None] * len(keys)
+    # Distinct uncached orders -> the positions that need them
+    misses = {}
+    for i, key in enumerate(keys):
+        data = _cache_get(key, date)
+        if data is None:
+            misses.setdefault(key, []).append(i)
+        else:
+            pdfs[i] = data
+    pending = list(misses)
+
+    if max_workers is None:
+        max_workers = os.cpu_count() or 1
+    if max_workers == 1 or len(pending) < PARALLEL_MIN_ORDERS:
+        rendered = _render_chunk(pending, date)
+    else:
+        from concurrent.futures import ProcessPoolExecutor
+
+        size = math.ceil(len(pending) / max_workers)
+        chunks = [pending[i:i + size] for i in range(0, len(pending), size)]
+        with ProcessPoolExecutor(max_workers=len(chunks)) as pool:
+            rendered = [pdf for chunk in pool.map(_render_chunk, chunks, [date] * len(chunks)) for pdf in chunk]
+
+    for key, data in zip(pending, rendered):
+        _cache_put(key, date, data)
+        for i in misses[key]:
+            pdfs[i] = data
+    return pdfs
+
+
+def clear_pdf_cache():
+    with _pdf_cache_lock:
+        _pdf_cache.clear()
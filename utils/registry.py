@@ -0,0 +1,122 @@
+# utils/registry.py
+"""
+Process-wide registry of formulations, product limits, catalogs and printer
+settings, loaded from the JSON files in Config/ (one file per section).
+
+Every session shares the same frozen copy: dicts are MappingProxyType and
+lists are tuples, so callers cannot change them in place. Edits go through
+save_section(), which rewrites the file; the registry reloads any section
+whose file changed (by mtime and size), checked at most once every
+RELOAD_CHECK_SECONDS, so edits reach every session without a restart.
+"""
+
+import json
+import os
+import threading
+import time
+from types import MappingProxyType
+
+CONFIG_DIR = os.environ.get("CRAFTHEALTH_CONFIG") or os.path.join(
+    os.path.dirname(os.path.dirname(os.path.abspath(__file__))), "Config"
+)
+SECTIONS = ("formulations", "products", "catalogs", "printer")
+# get_registry() runs on every Streamlit rerun; stat the files at most this often
+RELOAD_CHECK_SECONDS = 1.0
+
+_loaded = {}
+_registry = None
+_checked_at = 0.0
+_lock = threading.Lock()
+
+
+def freeze(value):
+    """Read-only copy of parsed JSON (dicts -> MappingProxyType, lists -> tuples)."""
+    if isinstance(value, dict):
+        return MappingProxyType({key: freeze(item) for key, item in value.items()})
+    if isinstance(value, (list, tuple)):
+        return tuple(freeze(item) for item in value)
+    return value
+
+
+def thaw(value):
+    """Mutable copy of a frozen value, e.g. to edit and pass to save_section()."""
+    if isinstance(value, (dict, MappingProxyType)):
+        return {key: thaw(item) for key, item in value.items()}
+    if isinstance(value, (list, tuple)):
+        return [thaw(item) for item in value]
+    return value
+
+
+def section_path(name: str) -> str:
+    if name not in SECTIONS:
+        raise ValueError(f"Unsupported config section '{name}'. Use one of: {', '.join(SECTIONS)}.")
+    return os.path.join(CONFIG_DIR, f"{name}.json")
+
+
+def _stamp(path: str):
+    try:
+        stat = os.stat(path)
+    except FileNotFoundError:
+        return None
+    return (stat.st_mtime_ns, stat.st_size)
+
+
+def _refresh(force: bool = False):
+    global _registry, _checked_at
+    if not force and _registry is not None and time.monotonic() - _checked_at < RELOAD_CHECK_SECONDS:
+        return
+    with _lock:
+        changed = False
+        for name in SECTIONS:
+            path = section_path(name)
+            stamp = _stamp(path)
+            current = _loaded.get(name)
+            if current is not None and current[0] == stamp:
+                continue
+            data = {}
+            if stamp is not None:
+                try:
+                    with open(path) as f:
+                        data = json.load(f)
+                except ValueError as e:
+                    # Keep serving the last good version of a broken file
+                    print(f"Config error in {path}: {e}")
+                    if current is not None:
+                        _loaded[name] = (stamp, current[1])
+                        continue
+            _loaded[name] = (stamp, freeze(data))
+            changed = True
+        if changed or _registry is None:
+            _registry = MappingProxyType({name: _loaded[name][1] for name in SECTIONS})
+        _checked_at = time.monotonic()
+
+
+def get_registry() -> MappingProxyType:
+    """The shared registry, {section: frozen data}, reloaded if Config/ changed."""
+    _refresh()
+    return _registry
+
+
+def get_section(name: str):
+    return get_registry()[name]
+
+
+def save_section(name: str, data):
+    """
+    Replace a section's file (atomically) and reload it, so every session
+    sees the change on its next run. `data` may be frozen or plain.
+    """
+    path = section_path(name)
+    partial = path + ".part"
+    with open(partial, "w") as f:
+        json.dump(thaw(data), f, indent=2)
+        f.write("\n")
+    os.replace(partial, path)
+    _refresh(force=True)
+
+
+def reload_registry():
+    """Re-read every section now, e.g. after editing Config/ by hand."""
+    with _lock:
+        _loaded.clear()
+    _refresh(force=True)